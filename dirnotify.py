@@ -0,0 +1,90 @@
+
+# *** XLOG2DB version ***
+
+# Linux inotify (via ctypes) on a watched folder, to wake the
+# watcher thread as soon as a logfile is created, modified or
+# moved in, rather than at the end of a fixed interval.
+# Only events for filenames matching a pattern count.
+# On other platforms, or on any failure, INotify() raises
+# and the caller should fall back to polling.
+
+import os, sys
+import ctypes, ctypes.util
+import errno
+import re
+import select
+import struct
+import time
+
+IN_MODIFY   = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE   = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+
+EVENT = struct.Struct('iIII')           # wd, mask, cookie, len (then name).
+
+class INotify():
+
+    def __init__(self, path, pattern=None, mask=(IN_MODIFY | IN_CREATE | IN_MOVED_TO)):
+        if not sys.platform.startswith('lin'):
+            raise OSError(errno.ENOSYS, 'inotify is linux only')
+        self.fd = -1
+        self.pattern = re.compile(pattern) if pattern else None
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, 'inotify_init1: %s' % os.strerror(e))
+        wd = libc.inotify_add_watch(fd, os.fsencode(path), mask)
+        if wd < 0:
+            e = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(e, 'inotify_add_watch(%s): %s' % (path, os.strerror(e)))
+        self.fd = fd
+
+    def _read(self, names):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        x = 0
+        while x + EVENT.size <= len(data):
+            wd, mask, cookie, n = EVENT.unpack_from(data, x)
+            x += EVENT.size
+            name = data[x:x + n].rstrip(b'\0').decode(errors='replace')
+            x += n
+            if mask & IN_Q_OVERFLOW:
+                names.add('')                   # Lost events: something changed.
+            elif name and (self.pattern is None or self.pattern.match(name)):
+                names.add(name)
+
+    def wait(self, timeout, settle=0.05):
+        """Wait up to timeout seconds for matching events.  Returns the set of
+           changed filenames, empty on timeout.  Events arriving within settle
+           seconds of the first are coalesced."""
+        names = set()
+        t1 = time.time() + timeout
+        while True:
+            w = t1 - time.time()
+            if w <= 0:
+                return names
+            r, _, _ = select.select([self.fd], [], [], w)
+            if not r:
+                return names
+            self._read(names)
+            if names:
+                t1 = min(t1, time.time() + settle)
+
+    def poll(self):
+        """Return the set of changed filenames since the last wait or poll, without waiting."""
+        names = set()
+        self._read(names)
+        return names
+
+    def close(self):
+        try:
+            if self.fd >= 0:
+                os.close(self.fd)
+        except:
+            pass
+        self.fd = -1
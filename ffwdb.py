@@ -4,70 +4,111 @@
 # DB for FlatFile Watching: XLOG output flatfiles.
 # Logfiles are id'd by a YYMMDD-HH.log filename.
 # YYMMDD-HH is, inconsequentially, a local date-time.
-# Logfiles are loaded into XLOG:xlog table and moved to a 
+# Logfiles are loaded into XLOG:xlog table and moved to a
 # XL2DB subdirectory.
-# Note: There's a similar, but different, same-named module for 
+# Table manifest holds the sha1s (as 20 byte blobs) of each
+# historical file's logrecs already committed to XLOG:xlog, so
+# that a rerun can skip them locally.  manifest() returns them
+# as 20 byte bytes too (not hex), to keep a big file's set small.
+# A finished file's manifest is dropped (dropmanifest), so the
+# filenames with one are mirrored too (manifests()).
+# Table logfiles is keyed by filename, and mirrored in memory
+# (write-through), so reads never query sqlite.  Writes commit
+# at once, or, inside "with ffwdb.batch():", once at the end.
+# acquired reconciles with a directory listing by set difference
+# against the mirror, so only vanished files' rows are written.
+# The rest's "acquired" is stamped in the mirror, and saved with
+# each row's next write (update), not rewritten every scan.
+# The db is in WAL mode.
+# Note: There's a similar, but different, same-named module for
 #       nl2xlog.
 
 import sqlite3
+import threading
+import contextlib
 
 FNS = ('filename', 'ymd', 'hh', 'modified', 'size', 'acquired', 'processed')
 
+CT_LOGFILES = """
+    create table if not exists logfiles (
+        filename    text primary key,
+        ymd         text,
+        hh          text,
+        modified    real,
+        size	    integer,
+        acquired    real,
+        processed	integer)
+"""
+
 
 class FFWDB():
 
     def __init__(self, ffwdbpfn):
         self.ffwdbpfn = ffwdbpfn
-        self.db = sqlite3.connect(self.ffwdbpfn)
+        self.lock = threading.RLock()
+        self.depth = 0                  # batch() nesting.
+        self.db = sqlite3.connect(self.ffwdbpfn, check_same_thread=False)
+        self.db.execute('pragma journal_mode=wal')
+        self.db.execute('pragma synchronous=normal')
+        self.migrate()
+        self.db.execute(CT_LOGFILES)
         self.db.execute("""
-            create table if not exists logfiles (
+            create table if not exists manifest (
                 filename    text,
-                ymd         text,
-                hh          text,
-                modified    real,
-                size	    integer,
-                acquired    real,
-                processed	integer)
+                sha1        blob)
         """)
-    
+        self.db.execute('create index if not exists manifest_filename on manifest (filename)')
+        self.db.execute('delete from manifest where filename not in (select filename from logfiles)')   # Orphans.
+        self.db.commit()
+        # The mirror.
+        self.fis = {}
+        csr = self.db.execute('select %s from logfiles' % ', '.join(FNS))
+        for r in csr.fetchall():
+            self.fis[r[0]] = dict(zip(FNS, r))
+        self.manifested = set(r[0] for r in self.db.execute('select distinct filename from manifest'))
+
+    def migrate(self):
+        """Give an older (unkeyed) logfiles table its filename primary key."""
+        z = self.db.execute('pragma table_info(logfiles)').fetchall()
+        if not z or any(r[1] == 'filename' and r[5] for r in z):
+            return
+        self.db.execute('alter table logfiles rename to logfiles_old')
+        self.db.execute(CT_LOGFILES)
+        self.db.execute('insert or replace into logfiles (%s) select %s from logfiles_old order by rowid' %
+                        (', '.join(FNS), ', '.join(FNS)))
+        self.db.execute('drop table logfiles_old')
+        self.db.commit()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Writes inside are one transaction."""
+        with self.lock:
+            self.depth += 1
+            try:
+                yield self
+            finally:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.db.commit()
+
+    def _commit(self):
+        if self.depth == 0:
+            self.db.commit()
+
     def disconnect(self):
         try:  self.db.close()
         except:  pass
-        
+
     def count(self, filename=None):
-        try:
-            csr = self.db.cursor()
-            if filename:
-                csr.execute('select count(*) from logfiles where filename=?', (filename, ))
-            else:
-                csr.execute('select count(*) from logfiles')
-            try:  return csr.fetchone()[0]
-            except:  return None
-        finally:
-            self.db.commit()
-        
+        if filename:
+            return 1 if filename in self.fis else 0
+        return len(self.fis)
+
     def select(self, filename):
-        rd = None
-        try:
-            self.db.row_factory = sqlite3.Row
-            csr = self.db.cursor()
-            csr.execute('select * from logfiles where filename=?', (filename, ))
-            try:  
-                rd = csr.fetchone()
-                if not rd:
-                    return
-                z = {}
-                for k in rd.keys():
-                    z[k] = rd[k]
-                rd = z
-            except Exception as E:
-                rd = None
-                errmsg = 'FFWDB.select: %s @ %s' % (E, mi.tblineno())
-                raise Exception(errmsg)
-        finally:
-            self.db.commit()
-            return rd
-        
+        """Return (a copy of) filename's fi, or None."""
+        z = self.fis.get(filename)
+        return dict(z) if z else None
+
     '''???
     def filenames(self):
         try:
@@ -80,112 +121,127 @@ class FFWDB():
     ???'''
 
     def insert(self, fi):
-        try:
+        with self.lock:
             filename = fi['filename']
-            if self.count(filename):
-                raise ValueError('FFWDB.insert: %d already in db' % (filename))
-            ks, qs, vs = [], [], []
-            for k, v in fi.items():
-                ks.append(k)
-                qs.append('?')
-                vs.append(v)
-            sql = 'insert into logfiles (%s) values (%s)' % (', '.join(ks), ', '.join(qs))
-            csr = self.db.cursor()
-            csr.execute(sql, vs)
-        finally:
-            self.db.commit()
-            return self.select(filename)
-        
+            if filename in self.fis:
+                raise ValueError('FFWDB.insert: %s already in db' % (filename))
+            z = dict((k, fi.get(k)) for k in FNS)
+            try:
+                self.db.execute('insert into logfiles (%s) values (%s)' % (', '.join(FNS), ', '.join(['?'] * len(FNS))),
+                                [z[k] for k in FNS])
+            finally:
+                self._commit()
+            self.fis[filename] = z
+            return dict(z)
+
     def update(self, fi):
-        try:
+        with self.lock:
             filename = fi['filename']
-            if not self.count(filename):
-                raise ValueError('FFWDB.update: %d not in db' % (filename))
-            kvs, vs = '', []
-            for k, v in fi.items():
-                if k == 'filename':
-                    continue
-                if kvs:
-                    kvs += ', '
-                kvs += (k + '=?')
-                vs.append(v)
-            vs.append(filename)
-            sql = 'update logfiles set %s where filename=?' % kvs
-            csr = self.db.cursor()
-            csr.execute(sql, vs)
-        finally:
-            self.db.commit()
-            return self.select(filename)
-        
+            z = self.fis.get(filename)
+            if z is None:
+                raise ValueError('FFWDB.update: %s not in db' % (filename))
+            ks = [k for k in fi if k != 'filename']
+            if ks:
+                vs = [fi[k] for k in ks]
+                if 'acquired' not in fi:            # The mirror's, freshened by acquired().
+                    ks, vs = ks + ['acquired'], vs + [z['acquired']]
+                try:
+                    self.db.execute('update logfiles set %s where filename=?' % ', '.join([k + '=?' for k in ks]),
+                                    vs + [filename])
+                finally:
+                    self._commit()
+                for k in fi:
+                    z[k] = fi[k]
+            return dict(z)
+
     def delete(self, filename):
-        try:
-            csr = self.db.cursor()
-            csr.execute('delete from logfiles where filename=?', (filename, ))
-        finally:
-            self.db.commit()
-        
+        with self.lock:
+            try:
+                csr = self.db.cursor()
+                csr.execute('delete from logfiles where filename=?', (filename, ))
+                csr.execute('delete from manifest where filename=?', (filename, ))
+            finally:
+                self._commit()
+            self.fis.pop(filename, None)
+            self.manifested.discard(filename)
+
+    def _afu(self, afu):
+        if   afu == 'a':  return sorted(self.fis)
+        elif afu == 'f':  return sorted(fn for fn, fi in self.fis.items() if fi['processed'] >= fi['size'])
+        elif afu == 'u':  return sorted(fn for fn, fi in self.fis.items() if fi['processed']  < fi['size'])
+        else:             raise Exception('bad kind')
+
     def oldestnewest(self, afu):
         """Return oldest and newest fi's. afu: a)ll, f)inished, u)nfinished."""
         #
-        # Note: Initially used "modified" to order, but in 
+        # Note: Initially used "modified" to order, but in
         #       testing several "filenames" ended up with
         #       the same "modified" (due to file copying).
         #       Since "filenames" are meant to be well behaved,
         #       ordering has been switched to that.
         #
+        fns = self._afu(afu)
+        if not fns:
+            return (None, None)
+        return (self.select(fns[0]), self.select(fns[-1]))
 
-        def foo(self, afu, on):
-            me = 'ffwdb.foo(%s, %s)' % (repr(afu), repr(on))
-            rd = None
-            try:
-                if   on == 'o':  z = 'asc'
-                elif on == 'n':  z = 'desc'
-                else:            raise Exception('bad on')
-                self.db.row_factory = sqlite3.Row
-                c = self.db.cursor()
-                if   afu == 'a':  sql = 'select * from logfiles                           order by filename %s limit 1' % z
-                elif afu == 'f':  sql = 'select * from logfiles where (processed >= size) order by filename %s limit 1' % z
-                elif afu == 'u':  sql = 'select * from logfiles where (processed  < size) order by filename %s limit 1' % z
-                else:             raise Exception('bad kind')
-                c.execute(sql)
-                rd = c.fetchone()
-                if not rd:
-                    return
-                z = {}
-                for k in rd.keys():
-                    z[k] = rd[k]
-                rd = z
-            except Exception as E:
-                rd = None
-                errmsg = '%s: %s @ %s' % (me, E, mi.tblineno())
-                raise Exception(errmsg)
-            finally:
-                try:    c.close()
-                except: pass
-                self.db.commit()
-                return rd
-
-        o_rd = n_rd = None
-        o_rd = foo(self, afu, 'o')
-        n_rd = foo(self, afu, 'n')
-        return (o_rd, n_rd)
+    def listing(self, afu):
+        """Return all fi's, by filename. afu: a)ll, f)inished, u)nfinished."""
+        return [self.select(fn) for fn in self._afu(afu)]
 
     def acquired(self, filenames, ts):
-        # Delete entries for nonexistent files.
-        # Update remaining files' "acquired" timestamp.
+        """Delete entries (and manifests) for files not in filenames.  Returns the filenames deleted."""
+        # A set difference against the mirror: only vanished files'
+        # rows are touched.  Remaining files' "acquired" timestamp is
+        # freshened in the mirror, and persisted with their next write.
         if not (filenames and ts):
-            return
-        try:
+            return []
+        with self.lock:
+            z = set(filenames)
+            gone = [(fn, ) for fn in self.fis if fn not in z]
+            if gone:
+                try:
+                    csr = self.db.cursor()
+                    csr.executemany('delete from logfiles where filename=?', gone)
+                    csr.executemany('delete from manifest where filename=?', gone)
+                finally:
+                    self._commit()
+                for (fn, ) in gone:
+                    del self.fis[fn]
+                    self.manifested.discard(fn)
+            for fi in self.fis.values():
+                fi['acquired'] = ts
+            return [fn for (fn, ) in gone]
+
+    def manifest(self, filename):
+        """Return the set of (20 byte) sha1s committed from filename."""
+        with self.lock:
             csr = self.db.cursor()
-            if len(filenames) == 1:
-                sql1 = 'delete from logfiles where filename!="%s"' % (filenames[0])
-                sql2 = 'update logfiles set acquired=?'
-            else:
-                z = ['"%s"' % fn for fn in filenames]
-                z = '(' + ', '.join(z) + ')'
-                sql1 = 'delete from logfiles where filename not in %s' % z
-                sql2 = 'update logfiles set acquired=?'
-            csr.execute(sql1)
-            csr.execute(sql2, (ts, ))
-        finally:
-            self.db.commit()
+            csr.execute('select sha1 from manifest where filename=?', (filename, ))
+            return set(bytes(z[0]) for z in csr.fetchall())
+
+    def addmanifest(self, filename, sha1s):
+        """Add (20 byte) sha1s committed from filename."""
+        with self.lock:
+            try:
+                csr = self.db.cursor()
+                csr.executemany('insert into manifest (filename, sha1) values (?, ?)',
+                                ((filename, sha1) for sha1 in sha1s))
+            finally:
+                self._commit()
+            self.manifested.add(filename)
+
+    def manifests(self):
+        """Return the filenames with manifests."""
+        return sorted(self.manifested)
+
+    def dropmanifest(self, filename):
+        """Delete filename's manifest (it's finished)."""
+        with self.lock:
+            if filename not in self.manifested:
+                return
+            try:
+                self.db.execute('delete from manifest where filename=?', (filename, ))
+            finally:
+                self._commit()
+            self.manifested.discard(filename)
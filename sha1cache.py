@@ -0,0 +1,85 @@
+
+# *** XLOG2DB version ***
+
+# In-process SHA1 membership cache for XLOG:xlog dedup.
+# An exact LRU set holds the most recently seen sha1s (sized
+# for the current and previous hour files).  As sha1s age out
+# of the LRU they're added to an optional Bloom filter.
+# An LRU hit is a known dupe.  A Bloom hit is only a maybe,
+# so it still has to be checked against the db.
+# Once seeded (with everything loaded since some rxts), a miss
+# in both for a logrec at or after that rxts is a known new, but
+# only if nothing else writes xlog (other collectors, other
+# xlog2db processes): xlog2db uses new() only if SHA1SOLEWRITER.
+
+import collections
+
+class SHA1Cache():
+
+    def __init__(self, lrumax, bloombits=0, bloomk=7):
+        self.lrumax = max(1, int(lrumax))
+        self.lru = collections.OrderedDict()
+        self.bloombits = int(bloombits)
+        self.bloomk = int(bloomk)
+        if self.bloombits > 0:
+            self.bloom = bytearray((self.bloombits + 7) // 8)
+        else:
+            self.bloom = None
+        self.since = None       # rxts from which misses are known new.
+        self.lost = False       # Aged out with no Bloom: misses prove nothing.
+
+    def _bits(self, sha1):
+        # sha1 is already uniform: double hashing from two slices.
+        h1 = int(sha1[:16], 16)
+        h2 = int(sha1[16:32], 16) | 1
+        for i in range(self.bloomk):
+            yield (h1 + i * h2) % self.bloombits
+
+    def _bloomadd(self, sha1):
+        for b in self._bits(sha1):
+            self.bloom[b >> 3] |= (1 << (b & 7))
+
+    def add(self, sha1):
+        lru = self.lru
+        if sha1 in lru:
+            lru.move_to_end(sha1)
+            return
+        lru[sha1] = None
+        if len(lru) > self.lrumax:
+            old, _ = lru.popitem(last=False)
+            if self.bloom is None:
+                self.lost = True
+            else:
+                self._bloomadd(old)
+
+    def known(self, sha1):
+        """Exact: sha1 has been seen."""
+        if sha1 in self.lru:
+            self.lru.move_to_end(sha1)
+            return True
+        return False
+
+    def maybe(self, sha1):
+        """Bloom: sha1 may have been seen (after aging out of the LRU)."""
+        if self.bloom is None:
+            return False
+        bloom = self.bloom
+        for b in self._bits(sha1):
+            if not (bloom[b >> 3] & (1 << (b & 7))):
+                return False
+        return True
+
+    def new(self, sha1, rxts):
+        """Known new: seeded to before rxts and not seen since."""
+        if self.lost or self.since is None or rxts < self.since:
+            return False
+        return not (sha1 in self.lru or self.maybe(sha1))
+
+    def seed(self, sha1s, since):
+        self.lost = False
+        for sha1 in sha1s:
+            self.add(sha1)
+        self.since = since
+
+    def __len__(self):
+        return len(self.lru)
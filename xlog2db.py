@@ -18,12 +18,52 @@
 ###       any older ones are static history. After history files 
 ###       are loaded, they are moved to a DONESD subdirectory.
 ###
-###     Windows and Linux compatible.
-###     Historical files will be reprocessed in their entirety 
-###       if terminated early. SHA1 hashes allows for the 
-###       skipping of duplicate logrecs during reruns.
+###     Windows and Linux compatible.  On Linux, inotify wakes
+###       the watcher as soon as a logfile changes.
+###     The live file is kept open and followed between cycles.
+###     Optionally (PIPELINE), reading, parsing and db writing are
+###       overlapped by a threaded pipeline with bounded queues.
+###     Optionally (BACKFILLWORKERS), historical files are parsed
+###       by a pool of processes, and written in order.
+###     Files are read as bytes, and 'processed' is the exact 
+###       offset past the last complete logrec consumed.
+###     Rows go to a sink (xlogsink.py): the XLOG MySQL server,
+###       or, with driver 'SQLITE', a local SQLite file.
+###     Optionally (WRITERS), batches are written in parallel over
+###       several connections, routed by sha1 prefix.
+###     Optionally (SPOOL, the default), while the sink is down or
+###       too slow, batches are spooled to disk (xlogspool.py)
+###       and files' progress keeps advancing.  The sink is retried
+###       with backoff, and the spool drained with set-wise dedup.
+###     Optionally (--metrics), counters, gauges and latency 
+###       histograms are served in the Prometheus text format on
+###       a local port, or rewritten to a stats file.
+###     Profiling (cProfile of some cycles, or sampled stacks) is
+###       toggled at runtime by a flag file (PROFILEFLAG).
+###     Each xlog batch commits a checkpoint of its file offset
+###       to XLOG.progress in the same transaction, so a file 
+###       terminated early resumes from its last batch.
+###       SHA1 hashes still allow for the skipping of duplicate 
+###       logrecs during reruns.
+###     Optionally (BULKBACKFILL), historical files are bulk 
+###       loaded: staged (MySQL: LOAD DATA) and merged into xlog
+###       with set-wise sha1 dedup on the server.
+###     Each historical file's committed sha1s are kept in a 
+###       manifest in xlog2db.s3, until it's finished, so reruns
+###       skip them without asking the db.  (The live file resumes from its exact
+###       checkpoint.)
+###     An in-process sha1 cache (sha1cache.py) answers repeat
+###       (dupe) checks without asking the db.
 ###     Rerun heartbeat records are harmless because only newer
 ###       timestamps are acknowledged.
+###     Our own heartbeat (SRCID, SUBID) carries ingest health in
+###       its kvs: logrecs per second, dupe ratio, unfinished files,
+###       live lag, and rxts to commit latency percentiles.
+###     Several wpaths (comma separated) can be watched by one 
+###       process: each has its own FFWDB, DONESD, live file and
+###       stats, and WATCHERS worker threads share them, and a
+###       pool of SINKS sink connections.  The sha1 and heartbeat
+###       caches are shared.
 ###
 ###     OLD flatfile format: used '|' to delimit fields in each 
 ###       record's prefix.  There was no version indicator.
@@ -34,7 +74,7 @@
 
 """
 Usage:
-  xlog2db.py [--ini=<ini> --srcid=<srcid> --subid=<subid> --wpath=<wpath> --donesd=<donesd> --interval=<interval> --xlogdb=<xlogdb>]
+  xlog2db.py [--ini=<ini> --srcid=<srcid> --subid=<subid> --wpath=<wpath> --donesd=<donesd> --interval=<interval> --xlogdb=<xlogdb> --watchers=<watchers> --sinks=<sinks> --writers=<writers> --metrics=<metrics>]
   xlog2db.py (-h | --help)
   xlog2db.py --version
 
@@ -44,10 +84,14 @@ Options:
   --ini=<ini>            Overrides default ini pfn.
   --srcid=<srcid>        Source ID ("xlog").
   --subid=<subid>        Sub    ID ("2db_").
-  --wpath=<wpath>        Path to be watched for "yymmdd-hh.log" pattern.
-  --donesd=<donesd>      Subdir of wpath for done files. Null disables.
+  --wpath=<wpath>        Path(s) (comma separated) to be watched for "yymmdd-hh.log" pattern.
+  --donesd=<donesd>      Subdir of (each) wpath for done files. Null disables.
   --interval=<interval>  Interval (seconds).
   --xlogdb=<xlogdb>      CFG of xlog database.
+  --watchers=<watchers>  Worker threads, for several wpaths [default: 1].
+  --sinks=<sinks>        Sink connections, for several wpaths.  0: one per watcher [default: 0].
+  --writers=<writers>    Parallel writer connections, by sha1 prefix.  0 or 1: none [default: 0].
+  --metrics=<metrics>    Metrics: a local http port (/metrics), or a stats file pfn.
 """
 
 import os, sys, stat
@@ -58,6 +102,9 @@ import pickle
 import copy
 import json
 import threading
+import queue
+import itertools
+import multiprocessing
 import re
 import gzip
 import hashlib
@@ -73,8 +120,6 @@ gLIN = sys.platform.startswith('lin')
 
 # Setup.
 
-WPATH = None                        # Everything is here, until it's sent.
-DONESD = None                       # Then it's here, if not None.                     
 INTERVAL = 6                        # Seconds.
 ENCODING = 'utf-8'                 
 ERRORS = 'strict'
@@ -121,41 +166,137 @@ def DOSQUAWK(errmsg, beeps=3):
 
 ####################################################################################################
 
-# >>> Table [xlog].  
-
-DB_FNS_XLOG = ('id', 'rxts', 'txts', 'srcid', 'subid', 'el', 'sl', 'sha1', 'kvs')
-DB_FNL_XLOG = DB_FIL_XLOG = ''  # Field name list, %s insertion list.
-for fn in DB_FNS_XLOG:
-    if fn == 'id':              # Skip the ISN.
-        continue
-    if DB_FNL_XLOG:
-        DB_FNL_XLOG += ', '
-        DB_FIL_XLOG += ', '
-    DB_FNL_XLOG += fn
-    DB_FIL_XLOG += '%s'
-
-# >>> Table [heartbeat].  (The same fields as in the xlog table.)
-DB_FNS_HBS = DB_FNS_XLOG
-DB_FNL_HBS, DB_FIL_HBS = DB_FNL_XLOG, DB_FIL_XLOG
-DB_FUL_HBS = ''                 # Field update list.
-for fn in DB_FNS_XLOG:
-    if fn == 'id':              # Skip the ISN.
-        continue
-    if DB_FUL_HBS:
-        DB_FUL_HBS += ', '
-    DB_FUL_HBS += '%s=%s' % (fn, '%s')
-DB_FUL_HBS = DB_FUL_HBS
-
-XLOGDB = None                   # The db connection.
-LOADRECS = None                 # Batches db loadrecs (really tuples) (created from logrecs).
-LOADCOMMITBATCHSIZE = 1000      # Inter-commit load count.
-
-NDUPE = NNEW = 0
-
-import mysql.connector as mc
+# Watches: one per watched directory (wpath), each with its own 
+# FFWDB, DONESD, open live file, staging and stats.  Code refers
+# to the current thread's watch as W (W.WPATH, W.FFWDB, ...).
+# Threads not running a watch (and a single wpath) get WATCH0.
+
+import xlogmetrics
+
+class Watch():
+
+    def __init__(self, wpath=None, donesd=None):
+        self.WPATH = wpath              # Everything is here, until it's sent.
+        self.DONESD = donesd            # Then it's here, if not None.
+        self.FFWDBPFN = os.path.normpath(wpath + '/xlog2db.s3') if wpath else None
+        self.FFWDB = None               # ffwdb.FFWDB, made by watchStart.
+        self.XLOGDB = None              # The sink (xlogsink.Sink), while this watch has one.
+        self.LOADRECS = []              # Batches db loadrecs (really tuples) (created from logrecs).
+        self.LOADRECST = 0              # When LOADRECS' first was staged (monotonic).
+        self.BATCHSIZE = None           # Adaptive inter-commit load count.  None: LOADCOMMITBATCHSIZE.
+        self.ROWCOST = None             # Seconds per row written (smoothed).
+        self.BULK = False               # The file being exported is bulk loaded.
+        self.HISTORICAL = False         # The file being exported is historical (so has a manifest).
+        self.EXPORTFN = None            # The file being exported.
+        self.EXPORTOFS = None           # Its offset past the last logrec in LOADRECS.  None: no checkpoints.
+        self.MANIFEST = None            # A historical file's manifest set (from FFWDB), of bytes sha1s...
+        self.MANIFESTFN = None          # ... and filename.
+        self.DIRNOTIFY = None           # dirnotify.INotify, made by watchStart.
+        self.TAIL = None                # {'filename', 'f', 'offset'}
+        self.SCANDIR = None             # {'wpath', 'mtime' (ns), 'fis': {filename: fi}} of the previous scan.
+        self.SCANCHANGED = set()
+        self.HEARTBEATS = {}            # Staging dict for heartbeat records.
+        # Stats.
+        self.NDUPE = self.NNEW = 0
+        self.NSHA1HIT = self.NSHA1MISS = 0      # Dedup checks answered by the cache, or by the db.
+        self.NMANIFEST = 0                      # Logrecs skipped by manifest (also counted in NDUPE).
+        self.NBEATS = self.NOLDBEATS = 0
+        self.NHBWRITES = 0                      # Heartbeats written.
+        self.PIPESTATS = {'read': 0.0, 'parse': 0.0, 'write': 0.0,  # Busy seconds (cumulative).
+                          'readq': 0, 'writeq': 0,                  # Max queue depths (last run).
+                          'blocks': 0}                              # Blocks written (cumulative).
+        self.PIPEQS = None                      # (readq, writeq), while the pipeline runs.
+        self.BACKFILLBPS = 0.0                  # Backfill bytes per second (smoothed).
+        self.NBACKLOG = self.BACKLOGBYTES = 0   # Unfinished historical files, and their unprocessed bytes.
+        self.LIVELAG = 0                        # Bytes of the live file not yet processed.
+        self.FILEBYTES = {}                     # {filename: bytes read}, while in FFWDB and unfinished (or live).
+        self.FILELINES = {}                     # {filename: logrecs read}.
+        self.HISTS = {k: xlogmetrics.Histogram() for k in   # Latencies (seconds).
+                      ('parse', 'commit', 'getfis', 'updatedbs', 'oldest', 'moved')}
+        # Parallel writers.
+        self.PENDING = collections.deque()      # Dispatched batches' tickets, oldest first.
+        self.INFLIGHT = set()                   # Their new sha1s (not yet in SHA1CACHE).
+        self.WRITEFAILED = None                 # A writer's exception, until PENDING is settled.
+        # Spool.
+        self.SPOOL = None               # xlogspool.Spool, made by watchStart (if SPOOL).
+        self.RETRYAT = 0                # Sink down (or slow) until (monotonic).  0: up.
+        self.RETRYWAIT = 0              # Its backoff.
+        self.RECONNECT = False          # Reconnect at retry.
+        self.NSPOOLED = self.NDRAINED = 0
+        # Scheduling (multiple wpaths).
+        self.UU = 0                     # Last cycle.
+        self.NCYCLES = 0
+
+WATCH0 = Watch()
+WATCHES = []                    # All, made by xlog2db.
+_WTLS = threading.local()
+
+def curWatch():
+    return getattr(_WTLS, 'watch', None) or WATCH0
+
+def setWatch(w):
+    _WTLS.watch = w
+
+class _CurWatch():
+    """W: the current thread's watch."""
+    def __getattr__(self, k):
+        return getattr(curWatch(), k)
+    def __setattr__(self, k, v):
+        setattr(curWatch(), k, v)
+
+W = _CurWatch()
 
 ####################################################################################################
 
+# >>> Tables [xlog], [heartbeat] and [progress] are the sink's
+#     (xlogsink.py): the XLOG MySQL server, or a local SQLite file.
+#     Each batch commits its file's checkpoint, in [progress], in
+#     the same transaction, for exactly-once resumption.
+import xlogsink
+
+DBCFG = None                    # Sink db cfg dict, from --xlogdb.
+LOADCOMMITBATCHSIZE = 1000      # Inter-commit load count (initial, if ADAPTBATCH).
+
+# Adaptive batching: each watch's batch size grows while the per
+# row cost of writing a batch keeps dropping, and shrinks when it
+# rises, when a batch's write takes over BATCHMAXLATENCY, or when
+# waits for the shared sha1 cache lock outweigh the write.  (Db lock
+# waits aren't measured apart: they show as write time.)  Only near
+# full batches are measured.  Bulk batches are fixed.  (MySQLSink
+# splits big inserts to fit max_allowed_packet.)
+# Staged loadrecs are flushed after LOADMAXAGE regardless.
+ADAPTBATCH = True
+BATCHMIN = 100
+BATCHMAX = 20000
+BATCHMAXLATENCY = 2.0           # Seconds.
+LOADMAXAGE = 1.0                # Seconds a loadrec may wait in LOADRECS.
+
+# Bulk backfill: historical files' batches are bulk loaded by the
+# sink (staged, then merged with set-wise sha1 dedup on the db
+# server).  The live file keeps the normal path.  MySQL's server
+# needs local_infile enabled, and sinks only allow LOAD DATA LOCAL
+# (client side) if BULKBACKFILL.
+BULKBACKFILL = False
+BULKBATCHSIZE = 50000           # Inter-commit load count, bulk loading.
+
+# In-process sha1 dedup cache (sha1cache.py), made at startup and 
+# shared by all watches (under SHA1LOCK).  An LRU hit is a known
+# dupe.  Anything else is asked of the db, unless SHA1SOLEWRITER:
+# xlog is shared by collectors, so a seeded cache's miss proves 
+# nothing unless this process is the only one writing it.
+SHA1CACHE = None
+SHA1LOCK = threading.Lock()
+SHA1LRUMAX = 250000             # Exact LRU entries (~current & previous hour files).  0 disables the cache.
+SHA1BLOOMBITS = 2**25           # Bloom filter bits (4 MB) for older sha1s.  0 disables.  Only SHA1SOLEWRITER reads it (else not made).
+SHA1SEEDHOURS = 2               # Seeding from xlog rows this recent.  0 disables.  Needs an xlog index on rxts.
+SHA1SOLEWRITER = False          # Seeded, a miss is known new (no db check).  Only if this process is xlog's only writer!
+import sha1cache
+
+####################################################################################################
+
+# Logrec parsing (shared with backfill worker processes).
+import xlogparse as _xp
+
 # Trim whitespace.  Remove trailing comma.  Remove quotes.  '-', ' ', '' -> None.
 def _S(x):
     if   isinstance(x, bytes):
@@ -171,9 +312,11 @@ def _S(x):
 
 # Database of log files in watched directory: xlog2db.s3:
 #   Table logfiles: ('filename', 'ymd', 'hh', 'modified', 'size', 'acquired', 'processed')
-# Note: sqlite3 db must be opened in watcherThread.
+# One per watch (W.FFWDB), at W.FFWDBPFN.  Its manifest holds the
+# sha1s already committed from the historical file being exported,
+# in memory (W.MANIFEST) as 20 byte digests, where its checkpoint
+# doesn't already cover them (see loadrecs2db).
 
-FFWDBPFN = FFWDB = None
 import ffwdb
 
 ####################################################################################################
@@ -185,10 +328,33 @@ REFNPATTERN = re.compile(FNPATTERN)
 
 ####################################################################################################
 
+# Watching: 'inotify' (Linux) wakes the watcher thread as soon as a
+# matching file is created, modified or moved into WPATH.  INTERVAL
+# polling remains as the fallback, and as a periodic reconciliation.
+
+WATCHMODE = 'inotify' if gLIN else 'poll'
+WAKEMIN = 0.5                   # Min seconds between event driven cycles.
+import dirnotify
+
+# Following: the live file is kept open (TAIL) across cycles and its
+# appendages read every FOLLOWPOLL seconds (or on inotify events).
+
+FOLLOW = True
+FOLLOWPOLL = 0.25               # Seconds.
+
+####################################################################################################
+
 def shutDown():
-    FFWDB.disconnect()
-    try:    XLOGDB.close()
-    except: pass
+    # (Several wpaths: watchStop disconnected each FFWDB, and 
+    # WATCH0's sink went back to SINKPOOL.)
+    if W.FFWDB:
+        W.FFWDB.disconnect()
+    if W.XLOGDB:
+        try:    W.XLOGDB.close()
+        except: pass
+        W.XLOGDB = None
+    if SINKPOOL:
+        SINKPOOL.close()
 
 #
 # updateDB: Update or add to FFWDB, given a file info dict.
@@ -198,12 +364,12 @@ def updateDB(ufi):
     me = 'updateDB'
     dbfi = None
     try:
-        dbfi = FFWDB.select(ufi['filename'])
+        dbfi = W.FFWDB.select(ufi['filename'])
         # Insert?
         if not dbfi:
             z = copy.copy(ufi)
             z['processed'] = 0
-            dbfi = FFWDB.insert(z)                  # Returns inserted.
+            dbfi = W.FFWDB.insert(z)                  # Returns inserted.
             z = None
             if not dbfi:
                 raise ValueError('db insertion failed')
@@ -216,7 +382,7 @@ def updateDB(ufi):
                 z['modified'] = ufi['modified']
                 z['size'] = ufi['size']
                 z['acquired'] = ufi['acquired']
-                dbfi = FFWDB.update(z)              # Returns updated.     
+                dbfi = W.FFWDB.update(z)              # Returns updated.     
                 assert dbfi, 'no dbfi returned from update'
                 z = None
             else:
@@ -259,9 +425,9 @@ def testS2E(s2e):
     finally:
         return (ne == 0)
 
-HB_EL, HB_SL = '0', 'h'         # !MAGIC! Heartbeat error level, sub level.
-HEARTBEATS = {}                 # Staging dict for heartbeat records.
-NBEATS = NOLDBEATS = 0
+HB_EL, HB_SL = _xp.HB_EL, _xp.HB_SL     # !MAGIC! Heartbeat error level, sub level.
+HBCACHE = None                  # {(srcid, subid): txts} last written, loaded at startup.  Shared.
+HBLOCK = threading.Lock()
 
 #
 # addHeartbeat: Add a heartbeat to a staging dict.
@@ -269,76 +435,131 @@ NBEATS = NOLDBEATS = 0
 #   1~rxts~txts~srcid~subid~el~sl~sha1~kvs       
 #   {"_el": "0", "_id": "SRC_", "_ip": "192.168.100.6", "_si": "SUB_", "_sl": "h", "_ts": "1449937097.9118", "dt_loc": "2015-12-12 08:18:17.9118", "dt_utc": "2015-12-12 16:18:17.9118"}
 #
-def addHeartbeat(logrec):
-    global HEARTBEATS, NBEATS, NOLDBEATS
-    me = 'addHeartbeat(%s)' % repr(logrec)
+def addHeartbeat(logrec, hbs=None):
+    """Stage a heartbeat, given its logrec (str or bytes) or its loadrec (tuple).
+       hbs: the staging dict, if not W.HEARTBEATS."""
+    me = 'addHeartbeat'
     try:
         # Unpack logrec.
-        (fv, rxts, txts, srcid, subid, el, sl, sha1, kvs) = logrec2fields(logrec)
-        if fv is None:
-            return
+        if isinstance(logrec, str):
+            logrec = logrec.encode(encoding=ENCODING, errors=ERRORS)
+        if isinstance(logrec, bytes):
+            kind, v = _xp.bytes2row(logrec)
+            if kind not in ('h', 'x'):
+                return
+        else:
+            v = logrec
+        (rxts, txts, srcid, subid, el, sl, sha1, kvs) = v
         assert ((el == HB_EL) and (sl == HB_SL)), 'bad hb el (%s) or sl (%s)' % (repr(el), repr(sl))
         assert txts, 'hb needs a txts'
-        NBEATS += 1
-        rxts2, txts2 = float(rxts), float(txts)
-        # Check staging dict.
-        k = srcid + '|' + subid
-        v = HEARTBEATS.get(k)
-        if v:
-            if not (txts2 > float(v[1])):       # !MAGIC! Tuple index.
-                NOLDBEATS += 1
-                return 
-        # logrec is new or newer: update staging dict. 
-        v = [_S(rxts2), _S(txts2), _S(srcid), _S(subid), _S(el), _S(sl), _S(sha1), _S(kvs)]  # !!! Matches xlog/heartbeat table.
-        HEARTBEATS[k] = v
+        W.NBEATS += 1
+        if not stageHeartbeat(W.HEARTBEATS if hbs is None else hbs, v):
+            W.NOLDBEATS += 1
     except Exception as E:
-        errmsg = '%s: E: %s @ %s' % (me, E, _m.tblineno())
+        errmsg = '%s(%s): E: %s @ %s' % (me, repr(logrec), E, _m.tblineno())
         DOSQUAWK(errmsg)
         raise
     finally:
         pass
 
 #
-# flushHeartbeats: Load staging dict contents into XLOG.heartbeat.
-#                  Only new or newer (by txts) are loaded.
+# stageHeartbeat: Add a heartbeat (loadrec) to a staging dict,
+#                 if it's new or newer (by txts).  
+#
+def stageHeartbeat(hbs, v):
+    """Returns False if hbs has it already, or newer."""
+    k = v[2] + '|' + v[3]                           # !MAGIC! Tuple indices.
+    z = hbs.get(k)
+    if z and not (float(v[1]) > float(z[1])):
+        return False
+    hbs[k] = list(v)                                # !!! Matches xlog/heartbeat table.
+    return True
+
+#
+# loadHBCache: HBCACHE from XLOG.heartbeat.
+#
+def loadHBCache():
+    global HBCACHE
+    HBCACHE = None
+    if NOLOAD:
+        return
+    try:
+        HBCACHE = W.XLOGDB.gethbs()
+    finally:
+        W.XLOGDB.commit()
+    _sl.info('heartbeat cache: {:,d} keys'.format(len(HBCACHE)))
+
+#
+# commitHeartbeats: Load staged heartbeats into XLOG.heartbeat, in
+#                   sink's open transaction, and commit it.  So a
+#                   checkpoint committed with them covers them.
+#                   Only new or newer (by txts) are loaded.  
+#                   HBCACHE answers which without asking the db.
+#                   (The sink checks would-be inserts' keys, in 
+#                   case another collector has since added them,
+#                   and updates only older txts.)  HBLOCK is held
+#                   only over HBCACHE, never over the sink's I/O: 
+#                   a writer calls this in its open transaction.
+#
+def commitHeartbeats(sink, hbs):
+    """Returns the number loaded."""
+    global HBCACHE
+    if not hbs:
+        sink.commit()
+        return 0
+    if HBCACHE is None:
+        z = sink.gethbs()                           # (In the open transaction.)
+        with HBLOCK:
+            if HBCACHE is None:
+                HBCACHE = z
+    with HBLOCK:                                    # HBCACHE is shared.
+        inserts, updates = [], []
+        for v in hbs:
+            k = (v[2], v[3])                        # !MAGIC! tuple indices.
+            xtxts = HBCACHE.get(k)
+            if   xtxts is None:
+                inserts.append(v)
+            elif float(v[1]) > xtxts:
+                updates.append(v)
+    if inserts or updates:
+        sink.upserthbs(inserts, updates)
+    sink.commit()
+    with HBLOCK:
+        for v in inserts + updates:
+            k, z = (v[2], v[3]), float(v[1])
+            if not (HBCACHE.get(k, 0) >= z):        # Another thread's may be newer.
+                HBCACHE[k] = z
+    return len(inserts) + len(updates)
+
+#
+# flushHeartbeats: Load the staging dict into XLOG.heartbeat, on its 
+#                  own.  (Batches' commits load it too.)  While the
+#                  sink's down, it's spooled.
 #
 def flushHeartbeats():
-    global HEARTBEATS
     me = 'flushHeartbeats'
+    w = curWatch()
     try:
-        if not HEARTBEATS:
+        if (not W.HEARTBEATS) or NOLOAD:
             return
-        assert XLOGDB, 'no XLOGDB'
-        for k, v in HEARTBEATS.items():
-            txts, srcid, subid = float(v[1]), v[2], v[3]    # !MAGIC! tuple indices.
-            try:
-                c = XLOGDB.cursor()
-                c.execute('select txts from heartbeat where srcid=%s and subid=%s', (srcid, subid))
-                try:    xtxts = c.fetchone()[0]
-                except: xtxts = None
-            finally:
-                c.close()
-            try:
-                c = XLOGDB.cursor()
-                if   xtxts is None:
-                    sql = 'insert into heartbeat (%s) values (%s)' % (DB_FNL_HBS, DB_FIL_HBS)
-                    c.execute(sql, v)
-                elif txts > xtxts:
-                    sql = 'update heartbeat set %s where srcid=%s and subid=%s' % (DB_FUL_HBS, '%s', '%s')
-                    v.append(srcid)
-                    v.append(subid)
-                    c.execute(sql, v)
-                else:
-                    continue
-            finally:
-                c.close()
-        pass
+        if W.RETRYAT:
+            spoolBatch(w, [], None, None)
+            return
+        assert W.XLOGDB, 'no XLOGDB'
+        W.NHBWRITES += commitHeartbeats(W.XLOGDB, list(W.HEARTBEATS.values()))
+        W.HEARTBEATS = {}
     except Exception as E:
+        if W.SPOOL is not None and W.XLOGDB and W.XLOGDB.isdown(E):
+            try:    W.XLOGDB.rollback()
+            except: pass
+            sinkDown(w, E)
+            spoolBatch(w, [], None, None)
+            return
         errmsg = '%s: E: %s @ %s' % (me, E, _m.tblineno())
         DOSQUAWK(errmsg)
         raise
     finally:
-        XLOGDB.commit()
+        endTxn()
 
 #
 # doneWithFile
@@ -351,12 +572,12 @@ def doneWithFile(filename):
     try:
 
         # Moving?
-        if not DONESD:
+        if not W.DONESD:
             return
 
         # SRC, SNK.
-        src = os.path.normpath(WPATH + '/' + filename)
-        snk = os.path.normpath(WPATH + '/' + DONESD + '/' + filename)
+        src = os.path.normpath(W.WPATH + '/' + filename)
+        snk = os.path.normpath(W.WPATH + '/' + W.DONESD + '/' + filename)
 
         # No SRC, already SNK?
         if not os.path.isfile(src):
@@ -366,10 +587,16 @@ def doneWithFile(filename):
             return
         if os.path.isfile(snk):
             _m.beeps(1)
-            errmsg = 'snk already in %s' % DONESD
+            errmsg = 'snk already in %s' % W.DONESD
             _sl.warning(errmsg)
             return
 
+        # Still TAIL?  (The new live file's empty.)  Take any
+        # late appends, then close it: it's not followed once
+        # it's moved (and can't be moved while open, on Windows).
+        if W.TAIL and W.TAIL['filename'] == filename:
+            followTail()
+            closeTail()
 
         # Do the move.  A failure is squawked and tolerated.
         try:
@@ -378,7 +605,7 @@ def doneWithFile(filename):
         except Exception as E:
             moved = False
             _m.beeps(3)
-            errmsg = 'moving %s to %s failed: %s' % (filename, DONESD, E)
+            errmsg = 'moving %s to %s failed: %s' % (filename, W.DONESD, E)
             _sl.warning(errmsg)
             pass                    # POR.
 
@@ -392,7 +619,7 @@ def doneWithFile(filename):
         if not os.path.isfile(snk):
             moved = False
             _m.beeps(1)
-            errmsg = 'snk dne in %s' % DONESD
+            errmsg = 'snk dne in %s' % W.DONESD
             _sl.warning(errmsg)
             return
 
@@ -402,81 +629,535 @@ def doneWithFile(filename):
         raise
     finally:
         if moved:
-            FFWDB.delete(filename)
+            W.FFWDB.delete(filename)          # And its manifest.
+            W.FILEBYTES.pop(filename, None)
+            W.FILELINES.pop(filename, None)
+            if not NOLOAD:
+                delProgress(filename)
+            if W.MANIFESTFN == filename:
+                W.MANIFEST = W.MANIFESTFN = None
+#
+# finishedFile: A finished (not live) file's manifest, its per
+#               file metrics, and its checkpoint in the sink, are
+#               no longer needed: drop them.  (Moved or not.)
+#
+def finishedFile(filename):
+    W.FFWDB.dropmanifest(filename)
+    if not NOLOAD:
+        delProgress(filename)
+    if W.MANIFESTFN == filename:
+        W.MANIFEST = W.MANIFESTFN = None
+    W.FILEBYTES.pop(filename, None)
+    W.FILELINES.pop(filename, None)
+
 #
 # loadrecs2db
 #
 def loadrecs2db():
     """Load a batch into db."""
-    global LOADRECS, NOLOAD, NDUPE, NNEW
-    try:    z = str(len(LOADRECS))
+    global NOLOAD
+    w = curWatch()
+    try:    z = str(len(w.LOADRECS))
     except: z = 'None'
     me = 'loadrecs2db(%s)' % (z)
     try:
-        if (not LOADRECS) or NOLOAD:
+        if w.LOADRECST:
+            w.HISTS['parse'].observe(time.monotonic() - w.LOADRECST)      # (Serial: read and parse.)
+            w.LOADRECST = 0
+        if (not w.LOADRECS) or NOLOAD:
+            endTxn(w)
             return
-        assert XLOGDB, 'no XLOGDB'
-        for lr in LOADRECS:
-            sha1 = lr[6]        
-            if len(sha1) != 40:
-                lr = lr
-                raise ValueError('funny SHA1: ' + repr(sha1))
-            # Already?
-            try:
-                c = XLOGDB.cursor()
-                c.execute('select count(*) from xlog where sha1=%s', (sha1,))
-                if c.fetchone()[0]:
-                    NDUPE += 1
+        assert w.XLOGDB, 'no XLOGDB'
+        # Unique by sha1 (first wins).  Repeats within
+        # the batch are dupes, as they'd be when loaded
+        # one at a time.  The file's manifest and the sha1 
+        # cache answer what they can; the rest are asked of 
+        # the db (or, BULK, left to the sink's merge).
+        manifest = w.MANIFEST if (w.MANIFESTFN == w.EXPORTFN) else None
+        news = collections.OrderedDict()
+        asks = []
+        sha1s = set()                       # For the manifest.
+        # Only where committed sha1s can be met again: a checkpointed
+        # batch's are all before its resume offset.  So .gz files (no
+        # checkpoints) and parallel writers' batches (a file resumes
+        # from the least of its parts').  Spooled batches' are added
+        # as they're drained.
+        keep = w.HISTORICAL and (w.EXPORTOFS is None or bool(WRITERQS))
+        # (Spooled sha1s are in neither SHA1CACHE nor INFLIGHT, so
+        # no known news while the spool's not drained.)
+        sole = SHA1SOLEWRITER and not (w.SPOOL is not None and (w.RETRYAT or len(w.SPOOL)))
+        t0 = time.perf_counter()
+        with SHA1LOCK:                      # SHA1CACHE is shared.
+            t1 = time.perf_counter()
+            for lr in w.LOADRECS:
+                sha1 = lr[6]
+                if len(sha1) != 40:
+                    lr = lr
+                    raise ValueError('funny SHA1: ' + repr(sha1))
+                if manifest and bytes.fromhex(sha1) in manifest:
+                    w.NDUPE += 1
+                    w.NMANIFEST += 1
                     continue
-            finally:
-                c.close()
-            # Insert into [xlog].
-            try:
-                c = XLOGDB.cursor()
-                sql = inssqlxlog  = 'insert into xlog (%s) values (%s)' % (DB_FNL_XLOG, DB_FIL_XLOG)
-                c.execute(sql, lr)
-                NNEW += 1
-            finally:
-                c.close()
-        pass
+                if keep:
+                    sha1s.add(sha1)
+                if sha1 in news or sha1 in w.INFLIGHT:
+                    w.NDUPE += 1
+                    continue
+                if SHA1CACHE is not None:
+                    if SHA1CACHE.known(sha1):
+                        w.NDUPE += 1
+                        w.NSHA1HIT += 1
+                        continue
+                    if w.BULK:
+                        news[sha1] = lr
+                        continue
+                    if sole and SHA1CACHE.new(sha1, float(lr[0])):
+                        w.NSHA1HIT += 1
+                        news[sha1] = lr
+                        continue
+                if not w.BULK:
+                    w.NSHA1MISS += 1
+                    asks.append(sha1)
+                news[sha1] = lr
+        # Parallel writers?  They take it from here.
+        t2 = time.perf_counter()
+        # Sink down (or spooled batches not yet drained)?  To the spool.
+        if w.SPOOL is not None and (w.RETRYAT or len(w.SPOOL)) and not drainSpool(w):
+            if WRITERQS:
+                settleWrites(w, wait=True)      # In order.
+            spoolBatch(w, list(news.values()), w.EXPORTFN, w.EXPORTOFS)
+            endTxn(w)
+            return
+        if WRITERQS:
+            dispatchWrites(w, news, asks, sha1s)
+            adaptBatch(w, len(w.LOADRECS), time.perf_counter() - t2, t1 - t0)
+            spoolSlow(w, time.perf_counter() - t2)
+            endTxn(w)
+            return
+        try:
+            # Already?  One set query for the whole batch.
+            if asks:
+                for sha1 in w.XLOGDB.dupes(asks):
+                    if news.pop(sha1, None) is not None:
+                        w.NDUPE += 1
+                        if SHA1CACHE is not None:
+                            with SHA1LOCK:
+                                SHA1CACHE.add(sha1)
+            # Insert into [xlog], by the sink's bulk path.
+            if news and w.BULK:
+                z = w.XLOGDB.bulkload(list(news.values()))
+                w.NNEW += z
+                w.NDUPE += len(news) - z
+            elif news:
+                w.XLOGDB.insertxlog(list(news.values()))
+                w.NNEW += len(news)
+            # Checkpoint, and the heartbeats it covers, in the same transaction.
+            if w.EXPORTFN and w.EXPORTOFS is not None:
+                putProgress(w.EXPORTFN, w.EXPORTOFS)
+            w.NHBWRITES += commitHeartbeats(w.XLOGDB, list(w.HEARTBEATS.values()))
+            w.HEARTBEATS = {}
+        except Exception as E:
+            if w.SPOOL is None or not w.XLOGDB.isdown(E):
+                raise
+            try:    w.XLOGDB.rollback()
+            except: pass
+            sinkDown(w, E)
+            spoolBatch(w, list(news.values()), w.EXPORTFN, w.EXPORTOFS)
+            return
+        e2eSample(news.values())
+        # Only committed sha1s are cached.  (BULK: all are now in xlog.)
+        if SHA1CACHE is not None:
+            with SHA1LOCK:
+                for sha1 in news:
+                    SHA1CACHE.add(sha1)
+        # All now in xlog: into the file's manifest.
+        addManifest(w, w.EXPORTFN, sha1s)
+        # Mirror the checkpoint.
+        if w.EXPORTFN and w.EXPORTOFS is not None and w.FFWDB:
+            w.FFWDB.update({'filename': w.EXPORTFN, 'processed': w.EXPORTOFS})
+        z = time.perf_counter() - t2
+        w.HISTS['commit'].observe(z)
+        adaptBatch(w, len(w.LOADRECS), z, t1 - t0)
+        spoolSlow(w, z)
+        endTxn(w)
     except Exception as E:
+        # Nothing of a failed batch is committed: not some
+        # of its rows without their checkpoint.
+        if w.XLOGDB and not w.RETRYAT:
+            try:    w.XLOGDB.rollback()
+            except: pass
         errmsg = '%s: E: %s @ %s' % (me, E, _m.tblineno())
         DOSQUAWK(errmsg)
         raise
     finally:
-        XLOGDB.commit()
-        LOADRECS = []
+        w.LOADRECS = []
+
+#
+# addManifest: Add committed (hex) sha1s to fn's manifest.
+#
+def addManifest(w, fn, sha1s):
+    if not (fn and sha1s and w.FFWDB):
+        return
+    z = [bytes.fromhex(sha1) for sha1 in sha1s]
+    w.FFWDB.addmanifest(fn, z)
+    if w.MANIFESTFN == fn:
+        w.MANIFEST.update(z)
 
 #
-# logrec2fields
+# Spool: with SPOOL, when the sink is down (a connection error) or
+# too slow (a batch's write over SPOOLSLOW), batches go to the
+# watch's spool (xlogspool.py, in its wpath's SPOOLSD) instead, and
+# the file's 'processed' advances as they're durably spooled.  The 
+# sink is retried (reconnected, if it was down) with exponential
+# backoff, SPOOLRETRYMIN to SPOOLRETRYMAX, and once it's back the 
+# spool is drained, oldest first, before any new batches, with
+# set-wise sha1 dedup: by the sink's bulk path if BULKBACKFILL (it
+# needs MySQL's local_infile), else by dupes() and insertxlog().
+# Staged heartbeats are spooled with the batch (or alone), and 
+# loaded before their segment's dropped.
 #
-def logrec2fields(logrec):
-    """Extract fields (which must exist, except when logrec is a ';' comment) from logrec."""
-    fv = rxts = txts = srcid = subid = el = sl = sha1 = kvs = None
+SPOOL = True
+SPOOLSD = 'xlog2db.spool'       # Subdir of wpath.
+SPOOLSYNC = True                # fsync each spooled batch.
+SPOOLSLOW = 30.0                # Seconds.
+SPOOLRETRYMIN = 1.0             # Seconds.
+SPOOLRETRYMAX = 60.0
+import xlogspool
+
+def sinkDown(w, E, reconnect=True):
+    """w's sink is down (or slow): spool, and retry after a backoff."""
+    if not w.RETRYAT:
+        _sl.warning('%s: sink %s (%s): spooling' % (w.WPATH, 'down' if reconnect else 'slow', E))
+    w.RECONNECT = w.RECONNECT or reconnect
+    w.RETRYWAIT = min(SPOOLRETRYMAX, max(SPOOLRETRYMIN, 2 * w.RETRYWAIT))
+    w.RETRYAT = time.monotonic() + w.RETRYWAIT
+
+def endTxn(w=None):
+    """The closing commit, if the sink's up.  A down sink is tolerated (and marked) with SPOOL."""
+    w = w or curWatch()
+    if not w.XLOGDB or w.RETRYAT:
+        return
     try:
-        # Comment?
-        if logrec[0] == ';':
-            kvs = logrec;                       # (ab)Use kvs field.
-            return
-        # Format value?
-        if logrec[1] == '\t' and logrec[0].isdigit():
-            fv = int(logrec[0])
-            if  fv == 1:
-                nt = logrec.count('\t')
-                if nt == 9:             # To handle a redundant sl in older preambles.
-                    (rxts, txts, srcid, subid, z, el, sl, sha1, kvs) = logrec[2:].split('\t', 8)
-                    raise ValueError('bad extra z (%s) vs sl (%s)' % (repr(z), repr(sl)))
-                else:
-                    (rxts, txts, srcid, subid, el, sl, sha1, kvs) = logrec[2:].split('\t', 7)
-            else:
-                raise ValueError('bad ffv: %d' % fv)
-        else:
-            fv, subid = 0, '____'                                           # !MAGIC! defaults.
-            (rxts, txts, srcid, el, sl, sha1, kvs) = logrec.split('|', 6)
+        w.XLOGDB.commit()
+    except Exception as E:
+        if w.SPOOL is None or not w.XLOGDB.isdown(E):
+            raise
+        sinkDown(w, E)
+
+def spoolSlow(w, dt):
+    if w.SPOOL is not None and dt > SPOOLSLOW:
+        sinkDown(w, '%.1fs batch' % dt, reconnect=False)
+
+def spoolBatch(w, lrs, fn, ofs):
+    """Spool a classified batch and the staged heartbeats, and advance its file's 'processed'."""
+    hbs = list(w.HEARTBEATS.values())
+    if lrs or hbs:
+        w.SPOOL.append(fn, ofs, lrs, hbs)
+        w.NSPOOLED += len(lrs)
+        w.HEARTBEATS = {}
+    if fn and ofs is not None and w.FFWDB:
+        w.FFWDB.update({'filename': fn, 'processed': ofs})
+
+def drainRows(w, lrs):
+    """Write spooled loadrecs (unique by sha1) that aren't already in xlog.  Returns the number inserted."""
+    if BULKBACKFILL:
+        return w.XLOGDB.bulkload(lrs)
+    z = w.XLOGDB.dupes([lr[6] for lr in lrs])
+    lrs = [lr for lr in lrs if lr[6] not in z]
+    if lrs:
+        w.XLOGDB.insertxlog(lrs)
+    return len(lrs)
+
+def drainSpool(w=None):
+    """If its retry is due, (reconnect and) drain w's spool.  Returns True if the sink's up and the spool's empty."""
+    w = w or curWatch()
+    me = 'drainSpool'
+    if w.SPOOL is None:
+        return True
+    if w.RETRYAT and time.monotonic() < w.RETRYAT:
+        return False
+    try:
+        if w.RECONNECT:
+            w.XLOGDB.reconnect()
+            w.RECONNECT = False
+            _sl.info('%s: sink reconnected' % w.WPATH)
+        while len(w.SPOOL):
+            # A segment at a time, unique by sha1 (first wins), 
+            # in BULKBATCHSIZE (or LOADCOMMITBATCHSIZE) commits.
+            news = collections.OrderedDict()
+            fns = collections.defaultdict(set)
+            hbs = {}
+            nr = 0
+            for fn, ofs, lrs, z in w.SPOOL.oldest():
+                for v in z:
+                    stageHeartbeat(hbs, v)
+                nr += len(lrs)
+                for lr in lrs:
+                    news.setdefault(lr[6], lr)
+                    if fn:
+                        fns[fn].add(lr[6])
+            lrs = list(news.values())
+            nn = 0
+            n = BULKBATCHSIZE if BULKBACKFILL else LOADCOMMITBATCHSIZE
+            for x in range(0, len(lrs), n):
+                nn += drainRows(w, lrs[x:x + n])
+                w.XLOGDB.commit()
+                e2eSample(lrs[x:x + n])
+            w.NHBWRITES += commitHeartbeats(w.XLOGDB, list(hbs.values()))
+            w.NNEW += nn
+            w.NDUPE += nr - nn
+            w.NDRAINED += nr
+            if SHA1CACHE is not None:
+                with SHA1LOCK:
+                    for sha1 in news:
+                        SHA1CACHE.add(sha1)
+            live = (w.FFWDB.oldestnewest('a')[1] or {}).get('filename') if w.FFWDB else None
+            for fn, z in fns.items():
+                if fn != live and w.FFWDB and w.FFWDB.count(fn):
+                    addManifest(w, fn, z)
+            w.SPOOL.drop()
+        if w.RETRYAT:
+            _sl.info('{}: spool drained: {:,d} rows spooled'.format(w.WPATH, w.NSPOOLED))
+        w.RETRYAT = w.RETRYWAIT = 0
+        return True
+    except Exception as E:
+        if not (w.XLOGDB and w.XLOGDB.isdown(E)):
+            errmsg = '%s: E: %s @ %s' % (me, E, _m.tblineno())
+            DOSQUAWK(errmsg)
+            raise
+        try:    w.XLOGDB.rollback()
+        except: pass
+        sinkDown(w, E)
+        return False
+
+#
+# Progress: per file checkpoints in the sink's progress table.
+#
+def getProgress(filename):
+    """Return filename's committed checkpoint, or 0.  (0 while the sink's down: FFWDB's stands.)"""
+    if NOLOAD or W.RETRYAT:
+        return 0
+    try:
+        return W.XLOGDB.getprogress(SRCID, SUBID, W.WPATH, filename, WRITERS)
+    except Exception as E:
+        if W.SPOOL is None or not (W.XLOGDB and W.XLOGDB.isdown(E)):
+            raise
+        sinkDown(curWatch(), E)
+        return 0
+    finally:
+        endTxn()
+
+def putProgress(filename, processed):
+    """Upsert filename's checkpoint.  Not committed: that's the caller's xlog batch."""
+    W.XLOGDB.putprogress(SRCID, SUBID, W.WPATH, filename, processed)
+
+def delProgress(filename):
+    if W.RETRYAT:
+        return                          # Sink down: left (harmless, as FFWDB has no entry).
+    try:
+        W.XLOGDB.delprogress(SRCID, SUBID, W.WPATH, filename)
+    except Exception as E:
+        if W.SPOOL is None or not (W.XLOGDB and W.XLOGDB.isdown(E)):
+            raise
+        sinkDown(curWatch(), E)
+    finally:
+        endTxn()
+
+#
+# Parallel writers: with WRITERS > 1, each batch's new loadrecs 
+# are routed by sha1 prefix to one of WRITERS writer threads, each
+# with its own sink connection, so a sha1's dedup check and insert 
+# are always on the same writer.  Each writer asks its own dupes,
+# inserts, checkpoints the file in its own progress row (partname)
+# and commits, independently of the others.  A batch's ticket is 
+# settled by the watch's thread, in order, once every writer has
+# committed its part: only then are its sha1s added to the manifest
+# and FFWDB's 'processed' advanced.  A file resumes from the least
+# of its writers' checkpoints (sha1 dedup covers the overlap).
+# A writer's failure fails the watch's later batches too (so no
+# checkpoint passes the lost rows), and is raised at settlement.
+# Rows from different writers interleave in xlog.  The writers'
+# sinks sit outside SINKPOOL (they're held for the whole run, and
+# would starve the watchers of theirs): connections are at most
+# SINKS + WRITERS.
+#
+WRITERS = 0                     # Writer threads (and connections).  0 or 1: none (the watch's sink writes).
+WRITERQS = []                   # Their queues, made by startWriters.
+WRITERTHREADS = []
+
+def startWriters():
+    """Start WRITERS writer threads, each with its own sink from DBCFG (not SINKPOOL's)."""
+    if WRITERS <= 1 or NOLOAD:
+        return
+    for n in range(WRITERS):
+        q = queue.Queue(PIPEQSIZE)
+        t = threading.Thread(target=writerThread, args=(n, q, xlogsink.makeSink(DBCFG, BULKBACKFILL)), name='xlog2db writer %d' % n)
+        t.start()
+        WRITERQS.append(q)
+        WRITERTHREADS.append(t)
+    _sl.info('writers: %d' % WRITERS)
+
+def stopWriters():
+    global WRITERQS, WRITERTHREADS
+    for q in WRITERQS:
+        q.put(None)
+    for t in WRITERTHREADS:
+        t.join()
+    WRITERQS, WRITERTHREADS = [], []
+
+def dispatchWrites(w, news, asks, sha1s):
+    """Route a classified batch's parts to the writers.  Settles what's done."""
+    n = len(WRITERQS)
+    parts = [([], set()) for x in range(n)]
+    for sha1, lr in news.items():
+        parts[int(sha1[:4], 16) % n][0].append(lr)
+    for sha1 in asks:
+        parts[int(sha1[:4], 16) % n][1].add(sha1)
+    ofs = w.EXPORTOFS if w.EXPORTFN else None
+    ticket = {'fn': w.EXPORTFN, 'ofs': ofs, 'sha1s': sha1s, 'news': set(news), 'n': n, 'lock': threading.Lock(), 
+              'done': threading.Event(), 'nnew': 0, 'ndupe': 0, 'err': None, 
+              'unwritten': [],          # Failed parts' loadrecs: to spool, if a writer's sink is down.
+              'hbs': list(w.HEARTBEATS.values()), 'nhbwrites': 0}  # Staged heartbeats: writer 0's.
+    w.HEARTBEATS = {}
+    w.PENDING.append(ticket)
+    w.INFLIGHT |= ticket['news']
+    for x in range(n):
+        WRITERQS[x].put((w, ticket, parts[x][0], parts[x][1], w.BULK))
+    settleWrites(w)
+
+def writerThread(n, q, sink):
+    """Write the parts routed to writer n."""
+    me = 'writer %d' % n
+    broken = False                      # Reconnect before the next job.
+    try:
+        while True:
+            job = q.get()
+            if job is None:
+                break
+            w, ticket, lrs, asks, bulk = job
+            part = lrs
+            hbs = ticket['hbs'] if n == 0 else []
+            nnew = ndupe = nhb = 0
+            dupes = set()
+            err = w.WRITEFAILED
+            if err is None:
+                t0 = time.perf_counter()
+                try:
+                    if broken:
+                        sink.reconnect()
+                        broken = False
+                    if asks:
+                        dupes = sink.dupes(asks)
+                        if dupes:
+                            lrs = [lr for lr in lrs if lr[6] not in dupes]
+                            ndupe += len(dupes)
+                    if lrs and bulk:
+                        z = sink.bulkload(lrs)
+                        nnew, ndupe = z, ndupe + len(lrs) - z
+                    elif lrs:
+                        sink.insertxlog(lrs)
+                        nnew = len(lrs)
+                    if ticket['fn'] and ticket['ofs'] is not None:
+                        sink.putprogress(SRCID, SUBID, w.WPATH, xlogsink.partname(ticket['fn'], n), ticket['ofs'])
+                    nhb = commitHeartbeats(sink, hbs)
+                    w.HISTS['commit'].observe(time.perf_counter() - t0)
+                    e2eSample(lrs)
+                    # Only committed sha1s are cached.
+                    if SHA1CACHE is not None:
+                        with SHA1LOCK:
+                            for lr in lrs:
+                                SHA1CACHE.add(lr[6])
+                            for sha1 in dupes:
+                                SHA1CACHE.add(sha1)
+                except Exception as E:
+                    try:    sink.rollback()
+                    except: pass
+                    err = w.WRITEFAILED = Exception('%s: %s' % (me, E))
+                    err.down = broken = sink.isdown(E)
+            if err:
+                nnew = ndupe = nhb = 0          # Rolled back (or not tried).
+            with ticket['lock']:
+                ticket['nnew'] += nnew
+                ticket['ndupe'] += ndupe
+                ticket['nhbwrites'] += nhb
+                if err:
+                    ticket['unwritten'].extend(part)
+                elif hbs:
+                    ticket['hbs'] = []
+                ticket['err'] = ticket['err'] or err
+                ticket['n'] -= 1
+                if ticket['n'] == 0:
+                    ticket['done'].set()
     finally:
-        try:    sha1 = sha1.lower()     # Safety.
-        except: sha1 = None
-        return (fv, rxts, txts, srcid, subid, el, sl, sha1, kvs)
+        sink.close()
+
+def settleWrites(w=None, wait=False):
+    """Apply the watch's committed batches, oldest first: stats, manifest, 'processed'.  
+       wait: all of them.  Raises a writer's failure (unless spooled)."""
+    w = w or curWatch()
+    err = None
+    while w.PENDING:
+        ticket = w.PENDING[0]
+        if not ticket['done'].is_set():
+            if not wait:
+                break
+            ticket['done'].wait()
+        w.PENDING.popleft()
+        w.INFLIGHT -= ticket['news']             # Committed (and cached), spooled, or failed.
+        w.NNEW += ticket['nnew']                 # Committed parts'.
+        w.NDUPE += ticket['ndupe']
+        w.NHBWRITES += ticket['nhbwrites']
+        for v in ticket['hbs']:                 # Not committed: staged again (to spool, or retry).
+            stageHeartbeat(w.HEARTBEATS, v)
+        if ticket['err'] and getattr(ticket['err'], 'down', False) and w.SPOOL is not None and not err:
+            # Sink down: the failed parts to the spool (counted when drained),
+            # and the committed parts' sha1s to the manifest.  One
+            # outage's down tickets back off once, not once each.
+            if not w.RETRYAT:
+                sinkDown(w, ticket['err'])
+            z = set(lr[6] for lr in ticket['unwritten'])
+            addManifest(w, ticket['fn'], ticket['sha1s'] - z)
+            spoolBatch(w, ticket['unwritten'], ticket['fn'], ticket['ofs'])
+            continue
+        err = err or ticket['err']
+        if err:
+            continue                            # Drain, but apply nothing past a failure.
+        fn = ticket['fn']
+        addManifest(w, fn, ticket['sha1s'])
+        if fn and ticket['ofs'] is not None and w.FFWDB:
+            w.FFWDB.update({'filename': fn, 'processed': ticket['ofs']})
+    if not w.PENDING:
+        w.WRITEFAILED = None
+        w.INFLIGHT.clear()
+    if err:
+        raise err
+
+#
+# seedSHA1Cache: Make SHA1CACHE, seeded with the sha1s of
+#                xlog rows received in the last SHA1SEEDHOURS.
+#
+def seedSHA1Cache(uu):
+    """Make and seed SHA1CACHE."""
+    global SHA1CACHE
+    me = 'seedSHA1Cache'
+    try:
+        SHA1CACHE = None
+        if not SHA1LRUMAX:
+            return
+        SHA1CACHE = sha1cache.SHA1Cache(SHA1LRUMAX, SHA1BLOOMBITS if SHA1SOLEWRITER else 0)
+        if not (SHA1SEEDHOURS and W.XLOGDB) or NOLOAD:
+            return
+        if not W.XLOGDB.rxtsindexed:
+            _sl.warning('sha1 cache not seeded: no xlog index on rxts')
+            return
+        since = uu - 3600 * SHA1SEEDHOURS
+        SHA1CACHE.seed(W.XLOGDB.sha1ssince(since), since)    # Newest end up in the LRU.
+        W.XLOGDB.commit()
+        _sl.info('sha1 cache seeded: {:,d}'.format(len(SHA1CACHE)))
+    except Exception as E:
+        errmsg = '%s: E: %s @ %s' % (me, E, _m.tblineno())
+        DOSQUAWK(errmsg)
+        raise
 
 #
 # logrec2loadrecs
@@ -500,82 +1181,98 @@ def logrec2fields(logrec):
 #
 def logrec2loadrecs(logrec):                               
     """Convert logrec and add to loadrecs."""
-    global LOADRECS
 
-    try:
+    z = logrec2loadrec(logrec)
+    if z is None:
+        return
+    w = curWatch()
+    w.LOADRECS.append(z)
+    n = len(w.LOADRECS)
+    if n == 1:
+        w.LOADRECST = time.monotonic()
+
+    # Commit batch?  Full, or too old.
+    if n >= batchSize(w) or (time.monotonic() - w.LOADRECST) >= LOADMAXAGE:
+        loadrecs2db()
 
-        try:    logrec = logrec.rstrip()    # No \n.
-        except: logrec = None
-        if not logrec:
-            return
+def batchSize(w=None):
+    w = w or curWatch()
+    return BULKBATCHSIZE if w.BULK else (w.BATCHSIZE or LOADCOMMITBATCHSIZE)
 
-        # Split logrec to fields.
-        (fv, rxts, txts, srcid, subid, el, sl, sha1, kvs) = logrec2fields(logrec)
-        if fv is None:
-            if kvs:
-                _sl.extra(kvs)      # Comment.
-            return
-        rxts2, txts2 = float(rxts), float(txts)
+def adaptBatch(w, n, dt, waited):
+    """Adapt w's batch size, given a batch of n loadrecs written in dt seconds, after waited for SHA1LOCK."""
+    size = w.BATCHSIZE or LOADCOMMITBATCHSIZE
+    if not ADAPTBATCH or w.BULK or n < size // 2 or dt <= 0:
+        return
+    cost = dt / n
+    if dt > BATCHMAXLATENCY or waited > dt:
+        size //= 2
+    elif w.ROWCOST is None or cost < 0.95 * w.ROWCOST:
+        size += size // 4
+    elif cost > 1.2 * w.ROWCOST:
+        size -= size // 5
+    w.ROWCOST = cost if w.ROWCOST is None else (0.7 * w.ROWCOST + 0.3 * cost)
+    w.BATCHSIZE = min(BATCHMAX, max(BATCHMIN, size))
 
-        # Heartbeat? 
-        if el == HB_EL and sl == HB_SL:   
-            addHeartbeat(logrec)
-            return
-        # Debug.
+#
+# logrec2loadrec: Convert a logrec to a loadrec, or None for a
+#                 blank, comment or (staged) heartbeat logrec.
+#
+def logrec2loadrec(logrec, hbs=None):
+    """Return logrec's (bytes, or str) loadrec, or None.  hbs: as addHeartbeat's."""
+    me = 'logrec2loadrec'
+    try:
+        if isinstance(logrec, bytes):
+            kind, z = _xp.bytes2row(logrec)         # Parsed once.
         else:
-            if   logrec.find('"a"') > -1:
-                logrec = logrec
-            elif logrec.find('"e"') > -1:
-                logrec = logrec
-            else:
-                logrec = logrec
-
-        # Stash info for db loading (via batch commits).
-
-        #
-        # (
-        # rxts   '1449993602.7583', 
-        # txts   '1449993602.7554', 
-        # srcid  'nx01', 
-        # subid  '____', 
-        # el     '0', 
-        # sl     'h', 
-        # sha1   '9b8328e4bbd014c6e50786b00d0672aa81bead47',
-        # kvs    '{"_el": "0", "_id": "nx01", "_ip": "192.168.100.6", "_si": "____", "_sl": "h", "_ts": "1449993602.7554", "ae": "h", "dt_loc": "2015-12-13 00:00:02.7554", "dt_utc": "2015-12-13 08:00:02.7554"}
-        # )
-        #
-
-        z = [_S(rxts2), _S(txts2), _S(srcid), _S(subid), _S(el), _S(sl), _S(sha1), _S(kvs)]  # !!! Matches xlog table.
-        LOADRECS.append(z)
-
-        # Commit batch?
-        if len(LOADRECS) >= LOADCOMMITBATCHSIZE:
-            loadrecs2db()
-
+            kind, z = _xp.logrec2row(logrec)
+        if   kind == 'x':
+            return z
+        elif kind == 'h':
+            addHeartbeat(z, hbs)
+        elif kind == 'c':
+            _sl.extra(z)            # Comment.
     except Exception as E:
         errmsg = '%s: E: %s @ %s' % (me, E, _m.tblineno())
         DOSQUAWK(errmsg)
         raise
-    finally:
-        pass
 
 #
 # Export a file, either history (whole file) or live (incremental).
 #
-def exportFile(historical, xfi):
-    """Export a file (from info dict)."""
+def exportFile(historical, xfi, maxbytes=None):
+    """Export a file (from info dict), or just its next maxbytes."""
     fn = xfi['filename']
     me = 'exportFile(%s, %s)' % (str(historical), fn)
     _sl.info('%s  %s  %s' % (_dt.ut2iso(_dt.locut()), fn, 'h' if historical else ''))#$#
     nb2e = 0                            # Finally references.
+    offset = f = None
     try:
 
         # Safety flush.
         loadrecs2db()  
+        W.EXPORTFN = fn
+        W.BULK = BULKBACKFILL and historical
+        W.HISTORICAL = historical
+
+        # This (historical) file's manifest.  Loaded once 
+        # per file, then kept current by loadrecs2db.
+        if historical and W.MANIFESTFN != fn:
+            W.MANIFEST, W.MANIFESTFN = W.FFWDB.manifest(fn), fn
+            if W.MANIFEST:
+                _sl.info('manifest: {:,d} sha1s'.format(len(W.MANIFEST)))
 
         # How many bytes of file is to be exported?
+        # The db's checkpoint is authoritative: FFWDB's 
+        # copy may lag it after a crash.
         fskip = xfi['processed']
         fsize = xfi['size']
+        if not pfnIsGz(fn):
+            z = getProgress(fn)
+            if fskip < z <= fsize:
+                _sl.info('resuming @ {:,d}'.format(z))
+                fskip = xfi['processed'] = z
+                W.FFWDB.update({'filename': fn, 'processed': z})
         nb2e = fsize - fskip
         if nb2e <= 0:
             return
@@ -585,7 +1282,7 @@ def exportFile(historical, xfi):
         # 151213-02.log -> 50,262 bytes -> 51,630 bytes.
 
         # Still exists?
-        pfn = os.path.normpath(WPATH + '/' + fn)
+        pfn = os.path.normpath(W.WPATH + '/' + fn)
         if not os.path.isfile(pfn):
             _m.beeps(1)
             errmsg = '%s: file dne' % me
@@ -594,30 +1291,51 @@ def exportFile(historical, xfi):
 
         # .gz files are always treated as historical, and 
         # the whole file is read. (No seek!)
-        if pfn.endswith('.gz'):          
-            with gzip.open(pfn, 'r', encoding=ENCODING, errors=ERRORS) as f:
-                for x, logrec in enumerate(f):
-                    if not (x % 1000):
-                        _sw.iw('.')
-                    logrec2loadrecs(logrec)
+        if pfnIsGz(pfn):          
+            W.EXPORTOFS = None
+            with gzip.open(pfn, 'rb') as f:
+                (pipeLines if PIPELINE else exportLines)(f, 0, True)
+            offset = fsize
             return
 
-        # Uncompressed files are read as text, with an initial
-        # seek from the SOF. The file is read to its end, even
-        # if this goes beyond the size given, which will 
-        # happen if XLOG appends to this file while we're 
-        # processing it. This will result in the appendage 
-        # being reprocessed next time around, but this is 
-        # harmless bcs logrec and heartbeat processing is 
-        # able to handle (skip) duplicates.
-        with open(pfn, 'r', encoding=ENCODING, errors=ERRORS) as f:
+        # Uncompressed files are read as bytes, with an initial
+        # seek from the SOF to 'processed'. Only complete (\n
+        # terminated) logrecs are consumed, even if the file 
+        # has grown beyond the size given, and 'processed' 
+        # becomes the exact offset past the last of them.  A 
+        # partial last logrec (XLOG still writing it) of the
+        # live file is left for next time around.
+        # Each loadrecs2db batch commits a checkpoint of 
+        # EXPORTOFS, kept current by exportLines.
+        # FOLLOW: the live file is kept open (as TAIL) and
+        # followed between cycles.
+        # POOL: historical files are parsed by worker processes.
+        W.EXPORTOFS = fskip
+        if POOL and historical:
+            if W.TAIL and W.TAIL['filename'] == fn:
+                f = W.TAIL['f']                   # To be closed.
             if fskip > 0:
                 _sl.info('skipping {:,d} bytes'.format(fskip))
+            offset = poolLines(pfn, fskip, maxbytes)
+            return
+        if W.TAIL and W.TAIL['filename'] == fn:
+            f = W.TAIL['f']
+            if W.TAIL['offset'] != fskip:
                 f.seek(fskip)
-            for x, logrec in enumerate(f):
-                if not (x % 1000):
-                    _sw.iw('.')
-                logrec2loadrecs(logrec)
+        else:
+            f = open(pfn, 'rb')
+            if fskip > 0:
+                _sl.info('skipping {:,d} bytes'.format(fskip))
+                f.seek(fskip)
+        offset = (pipeLines if PIPELINE else exportLines)(f, fskip, historical, maxbytes=maxbytes)
+        if FOLLOW and not historical:
+            if f.tell() != offset:
+                f.seek(offset)                  # Back to a partial logrec.
+            if not (W.TAIL and W.TAIL['f'] is f):
+                closeTail()
+                W.TAIL = {'filename': fn, 'f': f, 'offset': offset}
+            W.TAIL['offset'] = offset
+            f = None                            # Stays open.
 
     except Exception as E:
         nb2e *= -1                      # Prevent 'processed' update.
@@ -627,17 +1345,339 @@ def exportFile(historical, xfi):
     finally:
         # End dots.
         _sw.nl()                   
-        # Close src file.
-        try:  f.close
+        # Close src file (a drained or failed TAIL too).
+        if W.TAIL and W.TAIL['f'] is f:
+            W.TAIL = None
+        try:  f.close()
         except:  pass
-        # Update 'processed'?
-        if nb2e > 0 and not TESTONLY:
-            xfi['processed'] = fsize
-            z = {'filename': xfi['filename'], 'processed': xfi['processed']}
-            FFWDB.update(z)
         # Flush heartbeats and loadrecs.
         flushHeartbeats()
         loadrecs2db()
+        settleWrites(wait=True)
+        # Update 'processed'?  (Only after its logrecs are in.)
+        if nb2e > 0 and offset is not None and not TESTONLY:
+            xfi['processed'] = offset
+            z = {'filename': xfi['filename'], 'processed': xfi['processed']}
+            W.FFWDB.update(z)
+        W.EXPORTFN = W.EXPORTOFS = None
+        W.BULK = False
+
+#
+# exportLines: Export complete logrecs from a binary file.
+#
+def exportLines(f, offset, historical, dots=True, maxbytes=None):
+    """Export logrecs from f (at offset), up to maxbytes.  Returns offset past the last one consumed."""
+    limit = (offset + maxbytes) if maxbytes else None
+    w = curWatch()
+    z, n = offset, 0
+    try:
+        for x, line in enumerate(f):
+            if not line.endswith(b'\n') and not historical:
+                break                               # Partial: not yet.
+            if dots and not (x % 1000):
+                _sw.iw('.')
+            offset += len(line)
+            n += 1
+            if w.EXPORTOFS is not None:
+                w.EXPORTOFS = offset                # Before a possible batch commit.
+            logrec2loadrecs(line)
+            if limit is not None and offset >= limit:
+                break
+    finally:
+        countRead(w, offset - z, n)
+    return offset
+
+def countRead(w, nb, nl):
+    """Per file bytes and logrecs read."""
+    fn = w.EXPORTFN
+    if fn:
+        w.FILEBYTES[fn] = w.FILEBYTES.get(fn, 0) + nb
+        w.FILELINES[fn] = w.FILELINES.get(fn, 0) + nl
+
+def pfnIsGz(pfn):
+    return pfn.endswith('.gz')
+
+#
+# Pipeline: reader -> parser -> writer, with bounded queues of
+# LOADCOMMITBATCHSIZE logrec blocks, for exportFile's reads.
+# The reader and parser are threads.  The writer is the calling
+# (watcher) thread, so db and FFWDB work stays on one thread.
+# Heartbeats are staged by the parser in its block's own dict,
+# and into W.HEARTBEATS by the writer, with the block's loadrecs.
+# A full queue blocks its producer: explicit backpressure.
+#
+PIPELINE = False                # Use the pipeline (else exportLines).
+PIPEQSIZE = 8                   # Max blocks in each queue.
+
+def pipeLines(f, offset, historical, dots=True, maxbytes=None):
+    """As exportLines, through the pipeline.  Returns offset past the last one consumed."""
+    me = 'pipeLines'
+    w = curWatch()                      # For the reader and parser threads too.
+    readq, writeq = queue.Queue(PIPEQSIZE), queue.Queue(PIPEQSIZE)
+    stop = threading.Event()
+    errs = []
+    limit = (offset + maxbytes) if maxbytes else None
+
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reader():
+        setWatch(w)
+        z, lines, busy = offset, [], 0.0
+        t0 = time.perf_counter()
+        try:
+            for x, line in enumerate(f):
+                if not line.endswith(b'\n') and not historical:
+                    break                               # Partial: not yet.
+                if dots and not (x % 1000):
+                    _sw.iw('.')
+                z += len(line)
+                lines.append(line)
+                done = (limit is not None and z >= limit)
+                if len(lines) >= batchSize() or done:
+                    busy += time.perf_counter() - t0
+                    if not put(readq, (lines, z)):
+                        return
+                    lines = []
+                    t0 = time.perf_counter()
+                if done:
+                    break
+            busy += time.perf_counter() - t0
+            if lines:
+                put(readq, (lines, z))
+        except Exception as E:
+            errs.append(E)
+        finally:
+            W.PIPESTATS['read'] += busy
+            put(readq, None)
+
+    def parser():
+        setWatch(w)
+        busy = 0.0
+        try:
+            while True:
+                item = readq.get()
+                if item is None:
+                    break
+                W.PIPESTATS['readq'] = max(W.PIPESTATS['readq'], readq.qsize() + 1)
+                t0 = time.perf_counter()
+                lines, z = item
+                lrs, hbs = [], {}               # Heartbeats go with their block.
+                for line in lines:
+                    lr = logrec2loadrec(line, hbs)
+                    if lr is not None:
+                        lrs.append(lr)
+                t1 = time.perf_counter()
+                busy += t1 - t0
+                W.HISTS['parse'].observe(t1 - t0)
+                if not put(writeq, (lrs, z, len(lines), hbs)):
+                    return
+        except Exception as E:
+            errs.append(E)
+        finally:
+            W.PIPESTATS['parse'] += busy
+            put(writeq, None)
+
+    W.PIPESTATS['readq'] = W.PIPESTATS['writeq'] = 0
+    W.PIPEQS = (readq, writeq)
+    threads = [threading.Thread(target=reader, name='xlog2db reader'),
+               threading.Thread(target=parser, name='xlog2db parser')]
+    z = offset
+    try:
+        for t in threads:
+            t.start()
+        # Writer.
+        while True:
+            item = writeq.get()
+            if item is None:
+                break
+            W.PIPESTATS['writeq'] = max(W.PIPESTATS['writeq'], writeq.qsize() + 1)
+            t0 = time.perf_counter()
+            W.LOADRECS, ofs, nl, hbs = item
+            for v in hbs.values():
+                if not stageHeartbeat(W.HEARTBEATS, v):
+                    W.NOLDBEATS += 1
+            if W.EXPORTOFS is not None:
+                W.EXPORTOFS = ofs
+            loadrecs2db()
+            countRead(w, ofs - z, nl)
+            z = ofs
+            W.PIPESTATS['write'] += time.perf_counter() - t0
+            W.PIPESTATS['blocks'] += 1
+        if errs:
+            raise errs[0]
+    except Exception as E:
+        errmsg = '%s: E: %s @ %s' % (me, E, _m.tblineno())
+        DOSQUAWK(errmsg)
+        raise
+    finally:
+        W.PIPEQS = None
+        stop.set()
+        for t in threads:
+            t.join(1)
+        if TIMINGS:
+            _sl.warning('     pipe: read {:,.3f}s  parse {:,.3f}s  write {:,.3f}s  max readq {:d}  writeq {:d}'.format(
+                        W.PIPESTATS['read'], W.PIPESTATS['parse'], W.PIPESTATS['write'], 
+                        W.PIPESTATS['readq'], W.PIPESTATS['writeq']))
+    return z
+
+#
+# Pool: with BACKFILLWORKERS > 1, historical files (or a slice
+# of BACKFILLCHUNK per worker of one) are split into newline 
+# aligned byte ranges, parsed by worker processes (xlogparse).
+# Their blocks are written here, in file order, by loadrecs2db.
+#
+BACKFILLWORKERS = 0             # Worker processes.  0 or 1: none.
+POOLMINRANGE = 2**20            # Min bytes per range.
+POOL = None                     # multiprocessing.Pool, made in watcherThread.
+
+def poolLines(pfn, offset, maxbytes=None):
+    """As exportLines (historical), parsed by POOL.  Returns offset past the last one consumed."""
+    me = 'poolLines'
+    z = offset
+    try:
+        end = os.path.getsize(pfn)
+        if maxbytes:
+            end = min(end, offset + maxbytes * BACKFILLWORKERS)
+        if end <= offset:
+            return z
+        rs = collections.deque(_xp.ranges(offset, end, 4 * BACKFILLWORKERS, POOLMINRANGE))
+        # At most 2 ranges per worker in hand, applied in order.
+        pending = collections.deque()
+        while rs or pending:
+            while rs and len(pending) < 2 * BACKFILLWORKERS:
+                a, b = rs.popleft()
+                pending.append(POOL.apply_async(_xp.parseRange, ((pfn, a, b, True, batchSize()),)))
+            for lrs, hbs, cms, ofs in pending.popleft().get():
+                for cm in cms:
+                    _sl.extra(cm)           # Comment.
+                for hb in hbs:
+                    addHeartbeat(hb)
+                W.LOADRECS = lrs
+                if W.EXPORTOFS is not None:
+                    W.EXPORTOFS = ofs
+                loadrecs2db()
+                countRead(curWatch(), ofs - z, len(lrs) + len(hbs) + len(cms))
+                z = ofs
+            _sw.iw('.')
+    except Exception as E:
+        errmsg = '%s: E: %s @ %s' % (me, E, _m.tblineno())
+        DOSQUAWK(errmsg)
+        raise
+    return z
+
+#
+# Follow the live file: TAIL is kept open by exportFile and read
+# every FOLLOWPOLL seconds (or on inotify) between cycles.
+#
+def closeTail():
+    if W.TAIL:
+        try:    W.TAIL['f'].close()
+        except: pass
+    W.TAIL = None
+
+def followTail():
+    """Export what's been appended to TAIL.  Returns bytes consumed."""
+    fn, f, offset = W.TAIL['filename'], W.TAIL['f'], W.TAIL['offset']
+    me = 'followTail(%s)' % fn
+    z = offset
+    try:
+        W.EXPORTFN, W.EXPORTOFS = fn, offset
+        z = exportLines(f, offset, False, dots=False)
+        if f.tell() != z:
+            f.seek(z)
+        if z > offset:
+            flushHeartbeats()
+            loadrecs2db()
+            settleWrites(wait=True)
+            W.TAIL['offset'] = z
+            W.FFWDB.update({'filename': fn, 'processed': z})
+        W.LIVELAG = max(0, os.fstat(f.fileno()).st_size - z)
+    except Exception as E:
+        closeTail()
+        errmsg = '%s: %s @ %s' % (me, E, _m.tblineno())
+        DOSQUAWK(errmsg)
+        raise
+    finally:
+        W.EXPORTFN = W.EXPORTOFS = None
+    return z - offset
+
+def followLive(w):
+    """Follow TAIL for up to w seconds.  (inotify) Returns early when another logfile changes."""
+    t1 = time.time() + w
+    while W.TAIL and not FWTSTOP:
+        followTail()
+        w = t1 - time.time()
+        if w <= 0:
+            return
+        if W.DIRNOTIFY:
+            names = W.DIRNOTIFY.wait(w)
+            if not names:
+                return
+            if names - {W.TAIL['filename']}:
+                followTail()
+                return
+        else:
+            time.sleep(min(FOLLOWPOLL, w))
+
+#
+# Self telemetry: our own heartbeat's kvs also carry ingest health
+# (over all watches) since the previous beat: 'rps' logrecs per
+# second (new and dupes), 'dupr' dupe ratio, 'unfinished' files
+# (backlog, and the live file if it has unprocessed bytes),
+# 'livelag' bytes, and 'e2e_p50', 'e2e_p90' and 'e2e_p99' seconds
+# from logrecs' rxts to their commit.  The latter are from every
+# E2ESTRIDE'th committed logrec, at most E2EMAXSAMPLES per beat.
+# None: nothing to report.
+#
+HBSTATS = True
+E2ESTRIDE = 8
+E2EMAXSAMPLES = 10000
+E2E = collections.deque(maxlen=E2EMAXSAMPLES)     # Seconds, since the last beat.  Shared.
+HBLAST = None                   # (uu, logrecs, dupes) at the last beat.
+
+def e2eSample(lrs):
+    """Sample committed loadrecs' rxts to now latencies."""
+    if not HBSTATS:
+        return
+    now = time.time()
+    for lr in itertools.islice(lrs, 0, None, E2ESTRIDE):
+        try:    E2E.append(now - float(lr[0]))
+        except: pass
+
+def percentile(zs, p):
+    """Return the p (0 to 1) quantile of sorted zs, or None."""
+    if not zs:
+        return None
+    return round(zs[min(len(zs) - 1, int(p * len(zs)))], 3)
+
+def hbStats(uu):
+    """Return the self telemetry kvs, since the last beat."""
+    global HBLAST
+    ws = WATCHES or [WATCH0]
+    nnew = sum(w.NNEW for w in ws)
+    ndupe = sum(w.NDUPE for w in ws)
+    z = {'rps': None, 'dupr': None}
+    if HBLAST and uu > HBLAST[0]:
+        z['rps'] = round((nnew + ndupe - HBLAST[1]) / (uu - HBLAST[0]), 1)
+    if HBLAST and (nnew + ndupe) > HBLAST[1]:
+        z['dupr'] = round((ndupe - HBLAST[2]) / (nnew + ndupe - HBLAST[1]), 4)
+    HBLAST = (uu, nnew + ndupe, ndupe)
+    z['unfinished'] = sum(w.NBACKLOG + (1 if w.LIVELAG else 0) for w in ws)
+    z['livelag'] = sum(w.LIVELAG for w in ws)
+    zs = []
+    while E2E:
+        zs.append(E2E.popleft())
+    zs.sort()
+    for p in (50, 90, 99):
+        z['e2e_p%d' % p] = percentile(zs, p / 100)
+    return z
 
 #
 # ownHeartbeat
@@ -660,6 +1700,8 @@ def ownHeartbeat(uu=None):
                '_el': HB_EL, '_sl': HB_SL, 
                '_ip': None, '_ts': uuts, 
                'dt_loc': uliosfs, 'dt_utc': uuiosfs}
+        if HBSTATS:
+            kvs.update(hbStats(uu))
         kvsa = json.dumps(kvs, ensure_ascii=True, sort_keys=True)
         kvsab = kvsa.encode(encoding=ENCODING, errors=ERRORS)
         h = hashlib.sha1()
@@ -675,106 +1717,324 @@ def ownHeartbeat(uu=None):
         return logrec
 
 #
-# watcherThread
+# Backlog: historical files are drained back to back, with the
+# live file serviced between each BACKFILLCHUNK of them.
 #
-FWTRUNNING = False  # File Watcher Thread Running.
-FWTSTOP = False     # To signal a shutdown.
-FWTSTOPPED = False  # To acknowledge a shutdown.
-def watcherThread():
-    """A thread to watch WPATH for files to process."""
-    global LOADRECS, FFWDB, FWTRUNNING, FWTSTOP, FWTSTOPPED
+BACKFILLCHUNK = 4 * 2**20       # Bytes per backlog slice.  None: whole files.
 
-    LOADRECS = []
+def serviceLive(live):
+    """Export what's new in the live file."""
+    if not live:
+        return
+    if W.TAIL and W.TAIL['filename'] == live:
+        followTail()
+        return
+    fi = W.FFWDB.select(live)
+    if fi and fi['processed'] < fi['size']:
+        exportFile(False, fi)
+
+def liveLag(live):
+    """W.LIVELAG: bytes of the live file not yet processed."""
+    fi = W.FFWDB.select(live) if live else None
+    if not fi:
+        W.LIVELAG = 0
+        return
+    try:    W.LIVELAG = max(0, os.path.getsize(os.path.normpath(W.WPATH + '/' + live)) - fi['processed'])
+    except: W.LIVELAG = 0
 
-    me = 'watcher thread' 
-    try:
-        FWTRUNNING = True
-        assert XLOGDB, 'no XLOGDB'
+def backfillRate(nb, dt):
+    if nb <= 0 or dt <= 0:
+        return
+    z = nb / dt
+    W.BACKFILLBPS = z if not W.BACKFILLBPS else (0.8 * W.BACKFILLBPS + 0.2 * z)
+
+def reportBacklog(backlog):
+    W.NBACKLOG = len(backlog)
+    W.BACKLOGBYTES = sum(fi['size'] - fi['processed'] for fi in backlog)
+    if W.BACKFILLBPS:
+        eta = str(datetime.timedelta(seconds=int(W.BACKLOGBYTES / W.BACKFILLBPS)))
+    else:
+        eta = '?'
+    _sl.info('backlog: {:,d} files, {:,d} bytes, eta {}'.format(W.NBACKLOG, W.BACKLOGBYTES, eta))
+
+#
+# Shared by all watches: the backfill worker processes, the sha1
+# cache and the heartbeat cache.  W must have a sink.
+#
+def startShared():
+    global POOL
+    # Backfill worker processes, forked before any pipeline threads.
+    POOL = None
+    if BACKFILLWORKERS > 1:
+        POOL = multiprocessing.Pool(BACKFILLWORKERS)
+        _sl.info('backfill workers: %d' % BACKFILLWORKERS)
+    # Dedup cache, and last written heartbeats.
+    seedSHA1Cache(_dt.utcut())
+    loadHBCache()
+    # Parallel writers.
+    startWriters()
+
+def stopShared():
+    global POOL
+    stopProfile()
+    stopWriters()
+    if POOL:
+        POOL.terminate()
+        POOL = None
 
-        # Connect to FlatFileWatchDataBase.
-        FFWDB = ffwdb.FFWDB(FFWDBPFN)
-        assert FFWDB, 'no FFWDB'
+#
+# watchStart, watchCycle, watchStop: The current watch's (W's)
+# setup, cycle (scan, export, move) and teardown.
+#
+def watchStart():
+    W.LOADRECS = []
+
+    # Connect to FlatFileWatchDataBase.
+    W.FFWDB = ffwdb.FFWDB(W.FFWDBPFN)
+    assert W.FFWDB, 'no FFWDB'
+
+    # Spool.  (Any left from a previous run is drained first.)
+    W.SPOOL = None
+    if SPOOL and not NOLOAD:
+        W.SPOOL = xlogspool.Spool(os.path.join(W.WPATH, SPOOLSD), sync=SPOOLSYNC)
+        if len(W.SPOOL):
+            _sl.info('spool: {:,d} segments, {:,d} bytes'.format(len(W.SPOOL), W.SPOOL.nbytes))
+
+    # Event driven?
+    W.DIRNOTIFY = None
+    if WATCHMODE == 'inotify':
+        try:
+            W.DIRNOTIFY = dirnotify.INotify(W.WPATH, FNPATTERN)
+            _sl.info('watching: inotify (%s)' % W.WPATH)
+        except Exception as E:
+            _sl.warning('inotify unavailable (%s): polling' % E)
 
-        uu = 0                                                  # Unix Utc.
-        while not FWTSTOP:
+def watchCycle(uu):
+    """Scan W's files, export them, and move finished ones."""
+    try:
+        W.UU = uu
+        ul = _dt.locut(uu)
+        uuts = '%15.4f' % uu                                # 15.4, unblanked fraction.
+        uuiosfs = _dt.ut2isofs(uu)
+        uliosfs = _dt.ut2isofs(ul)
 
-            #
-            flushHeartbeats()
-           
-            # Wait out INTERVAL.
-            z = time.time()
-            w = INTERVAL - (z - uu)
-            if w > 0:
-                _sw.wait(w)
-            uu = _dt.utcut()
-            ul = _dt.locut(uu)
-            uuts = '%15.4f' % uu                                # 15.4, unblanked fraction.
-            uuiosfs = _dt.ut2isofs(uu)
-            uliosfs = _dt.ut2isofs(ul)
+        # Heartbeat?  (Ours, one per process: by the first watch.)
+        if OWNHEARTBEAT and curWatch() is (WATCHES[0] if WATCHES else WATCH0):
+            logrec = ownHeartbeat(uu)
+            addHeartbeat(logrec)
 
-            # Heartbeat?
-            if OWNHEARTBEAT:
-                logrec = ownHeartbeat(uu)
-                addHeartbeat(logrec)
+        # Spooled?  Drain, if the sink's retry is due.
+        if W.SPOOL is not None and (W.RETRYAT or len(W.SPOOL)):
+            drainSpool()
 
-            # Files?
+        # Files?  Update FFWDB.
+        fis = scanDir(uu)
+        if not fis:
+            errmsg = 'no logfiles @ ' + uliosfs
+            raise Exception(errmsg)
+        if W.TAIL and W.TAIL['filename'] not in [fi['filename'] for fi in fis]:
+            closeTail()                     # Gone.
+
+        # Unfinished files in DB.  The newest file of all
+        # is live, and any older unfinished ones are backlog.
+        t0 = time.perf_counter();
+        ufis = W.FFWDB.listing('u')
+        z, n_dbfi = W.FFWDB.oldestnewest('a')
+        live = n_dbfi['filename'] if n_dbfi else None
+        backlog = [fi for fi in ufis if fi['filename'] != live]
+        t1 = time.perf_counter();
+        W.HISTS['oldest'].observe(t1 - t0)
+        if TIMINGS:
+            _sl.warning('   oldest: {:9,.1f} ms'.format((1000*(t1-t0))))
+
+        # Drain the backlog, back to back, in BACKFILLCHUNK
+        # slices, servicing the live file between slices.
+        if backlog:
+            reportBacklog(backlog)
+        else:
+            W.NBACKLOG = W.BACKLOGBYTES = 0
+        for fi in backlog:
+            while not FWTSTOP:
+                z = fi['processed']
+                t0 = time.perf_counter();
+                exportFile(True, fi, BACKFILLCHUNK)
+                t1 = time.perf_counter();
+                backfillRate(fi['processed'] - z, t1 - t0)
+                serviceLive(live)
+                if fi['processed'] >= fi['size'] or fi['processed'] <= z:
+                    break
+            if FWTSTOP:
+                break
+        serviceLive(live)
+        liveLag(live)
+
+        # Move finished files.
+        # Not the newest, and therefore "live", file.
+        if W.DONESD:
             t0 = time.perf_counter();
-            fis = getFIs(uu)
+            for fi in W.FFWDB.listing('f'):
+                if FWTSTOP:
+                    break
+                if fi['filename'] != live:
+                    doneWithFile(fi['filename'])
             t1 = time.perf_counter();
+            W.HISTS['moved'].observe(t1 - t0)
             if TIMINGS:
-                _sl.warning('   getFIs: {:9,.1f} ms'.format((1000*(t1-t0))))
-            if not fis:
-                errmsg = 'no logfiles @ ' + uliosfs
-                raise Exception(errmsg)
-
-            # Update FFWDB. 
-            # Freshen the "acquired" timestamp.
-            # Delete entries for nonexistent files.
-            t0 = time.perf_counter();
-            filenames = [fi['filename'] for fi in fis]
-            filenames.sort()
-            # Compare real (nf) and db (nx) counts.
-            nf = len(filenames)
-            nx = FFWDB.count()
-            if   nf < nx:
-                nf, nx = nf, nx
-            elif nf > nx:
-                nf, nx = nf, nx
+                _sl.warning('    moved: {:9,.1f} ms'.format((1000*(t1-t0))))
+
+        # Finished files' manifests (metrics, checkpoints), moved or not, are dropped.
+        for fn in sorted(set(W.FFWDB.manifests()) | set(W.FILEBYTES)):
+            fi = W.FFWDB.select(fn)
+            if fn != live and fi and fi['processed'] >= fi['size']:
+                finishedFile(fn)
+    finally:
+        W.NCYCLES += 1                  # Done (or failed).  ONECHECK waits for it.
+
+def watchStop():
+    try:
+        # Flush heartbeats and loadrecs.
+        flushHeartbeats()
+        loadrecs2db()
+        settleWrites(wait=True)
+    finally:
+        closeTail()
+        if W.SPOOL is not None:
+            W.SPOOL.close()
+        if W.DIRNOTIFY:
+            W.DIRNOTIFY.close()
+            W.DIRNOTIFY = None
+        if W.FFWDB:
+            W.FFWDB.disconnect()
+
+#
+# Profiling, toggled at runtime: create PROFILEFLAG (next to LFPFN)
+# and, at the next cycle, it's taken (deleted) and profiling starts.
+# Its contents, all optional:
+#   [cprofile] [<cycles>]   cProfile the next <cycles> watch cycles
+#                           (PROFILECYCLES), in whichever threads,
+#                           and the live file follows between them.
+#   sample [<seconds>]      Sample all threads' stacks (pipeline,
+#                           writers, ...) every PROFILEINTERVAL for
+#                           <seconds> (PROFILESECONDS).
+#   off                     Stop now.
+# Reports (xlogprofile.py) go next to LFPFN, as xlog2db-<utc>.pstats
+# and .txt, or .collapsed (for flamegraph.pl).  Backfill worker 
+# processes (BACKFILLWORKERS) aren't profiled.
+#
+PROFILEFLAG = 'xlog2db.profile'
+PROFILECYCLES = 10
+PROFILESECONDS = 30
+PROFILEINTERVAL = 0.005         # Seconds between samples.
+PROFILER = None                 # xlogprofile.CycleProfiler or Sampler, while profiling.
+PROFILELOCK = threading.Lock()
+import xlogprofile
+
+def profilePath(fn):
+    return os.path.join(os.path.dirname(os.path.abspath(LFPFN)) if LFPFN else '.', fn)
+
+def checkProfile():
+    """Start (or stop) profiling, if PROFILEFLAG's there.  Report a finished profile."""
+    global PROFILER
+    pfn = profilePath(PROFILEFLAG)
+    if not (PROFILER or os.path.exists(pfn)):
+        return
+    with PROFILELOCK:
+        if os.path.exists(pfn):
+            try:
+                with open(pfn, encoding='utf-8', errors='replace') as f:
+                    z = f.read().split()
+                os.remove(pfn)
+            except Exception as E:
+                _sl.warning('%s: %s' % (PROFILEFLAG, E))
+                return
+            stopProfile(False)
+            n = ([int(x) for x in z if x.isdigit()] or [None])[0]
+            if 'off' in z:
+                pass
+            elif 'sample' in z:
+                PROFILER = xlogprofile.Sampler(n or PROFILESECONDS, PROFILEINTERVAL)
+                PROFILER.start()
+                _sl.info('profiling: sampling for %d seconds' % (n or PROFILESECONDS))
             else:
-                nf, nx = nf, nx
-            FFWDB.acquired(filenames, uu)
-            for fi in fis:
-                z = updateDB(fi)
-            t1 = time.perf_counter();
-            if TIMINGS:
-                _sl.warning('updateDBs: {:9,.1f} ms'.format((1000*(t1-t0))))
+                PROFILER = xlogprofile.CycleProfiler(n or PROFILECYCLES)
+                _sl.info('profiling: %d cycles' % (n or PROFILECYCLES))
+        elif PROFILER and PROFILER.done:
+            stopProfile(False)
+
+def stopProfile(lock=True):
+    """Write the profile's reports, if profiling."""
+    global PROFILER
+    if lock:
+        with PROFILELOCK:
+            return stopProfile(False)
+    z, PROFILER = PROFILER, None
+    if z is None:
+        return
+    try:
+        pfns = z.write(profilePath(time.strftime('xlog2db-%y%m%d-%H%M%S', time.gmtime())))
+        _sl.info('profile: ' + (', '.join(pfns) or 'nothing'))
+    except Exception as E:
+        _sl.warning('profile: %s' % E)
+
+def runProfiled(fn, *args, cycle=True):
+    """fn(*args), profiled if PROFILER's a CycleProfiler.  cycle: counts as one of its cycles."""
+    z = PROFILER
+    if isinstance(z, xlogprofile.CycleProfiler):
+        return z.run(fn, *args, count=cycle)
+    return fn(*args)
+
+def runCycle(uu):
+    """watchCycle(uu), maybe profiled."""
+    checkProfile()
+    return runProfiled(watchCycle, uu)
+
+def watcherPass(uu):
+    """One pass of watcherThread's loop: flush, follow TAIL (or wait) until 
+       INTERVAL after uu, and run a cycle.  Returns the cycle's uu."""
+    flushHeartbeats()
+
+    # Wait out INTERVAL, or (inotify) until a logfile changes.
+    z = time.time()
+    w = INTERVAL - (z - uu)
+    if w > 0:
+        if W.TAIL:
+            followLive(w)
+        elif W.DIRNOTIFY:
+            z = WAKEMIN - (z - uu)
+            if z > 0:
+                time.sleep(z)
+            W.DIRNOTIFY.wait(w - max(z, 0))
+        else:
+            _sw.wait(w)
+    uu = _dt.utcut()
 
-            # Find the oldest, newest unfinished files in DB.
-            t0 = time.perf_counter();
-            o_dbfi, n_dbfi = FFWDB.oldestnewest('u')
-            t1 = time.perf_counter();
-            if TIMINGS:
-                _sl.warning('   oldest: {:9,.1f} ms'.format((1000*(t1-t0))))
+    watchCycle(uu)
+    return uu
 
-            # Something unfinished?
-            if o_dbfi:  
+#
+# watcherThread: A single wpath (WATCH0).
+#
+FWTRUNNING = False  # File Watcher Thread Running.
+FWTSTOP = False     # To signal a shutdown.
+FWTSTOPPED = False  # To acknowledge a shutdown.
+def watcherThread():
+    """A thread to watch WPATH for files to process."""
+    global FWTRUNNING, FWTSTOP, FWTSTOPPED
 
-                fn = o_dbfi['filename']
-                historical = (fn != n_dbfi['filename'])
+    me = 'watcher thread' 
+    try:
+        FWTRUNNING = True
+        assert W.XLOGDB, 'no XLOGDB'
+        startShared()
+        watchStart()
 
-                # Export the file.
-                exportFile(historical, o_dbfi)    # !CHANGE!
+        uu = 0                                                  # Unix Utc.
+        while not FWTSTOP:
 
-            # Move oldest finished file? 
-            # It must not be the only, and therefore "live", file.
-            if DONESD:
-                o_dbfi, n_dbfi = FFWDB.oldestnewest('f')
-                if o_dbfi and (n_dbfi['filename'] != o_dbfi['filename']):
-                    t0 = time.perf_counter();
-                    doneWithFile(o_dbfi['filename'])
-                    t1 = time.perf_counter();
-                    if TIMINGS:
-                        _sl.warning('    moved: {:9,.1f} ms'.format((1000*(t1-t0))))
+            # Follow (or wait), then a cycle: profiled together.
+            checkProfile()
+            uu = runProfiled(watcherPass, uu)
+            reportWatches()
 
             if ONECHECK:
                 FWTSTOP = True
@@ -791,20 +2051,254 @@ def watcherThread():
         DOSQUAWK(errmsg)
         raise      
     finally:
-        # Flush heartbeats and loadrecs.
-        flushHeartbeats()
-        loadrecs2db()
-        if FWTSTOP:
+        try:
+            watchStop()
+            reportWatches(True)
+        finally:
+            if FWTSTOP:
+                FWTSTOPPED = True
+            stopShared()
+            _sl.info('%s exits. STOPPED: %s' % (me, str(FWTSTOPPED)))
+            FWTRUNNING = False
+
+#
+# Multiple wpaths: WATCHERS worker threads share the WATCHES (a
+# watch is only ever run by one worker at a time, taken from and 
+# put back on WATCHQ) and a SINKPOOL of at most SINKS sinks.  A
+# worker runs a watch's cycle when due (INTERVAL, or sooner on
+# inotify events), and otherwise follows its live file.
+#
+WATCHERS = 1                    # Worker threads.
+SINKS = 0                       # Sink connections (writers' aren't counted).  0: WATCHERS.
+SINKPOOL = None                 # xlogsink.SinkPool, made by xlog2db.
+WATCHQ = None                   # queue.Queue of watches.
+STATSINTERVAL = 60              # Seconds between per watch stats reports.
+STATSUU = 0
+STATSLOCK = threading.Lock()
+
+def watchDue(w, uu):
+    """Is watch w due a cycle?"""
+    z = uu - w.UU
+    if z >= INTERVAL:
+        return True
+    if w.DIRNOTIFY and z >= WAKEMIN:
+        names = w.DIRNOTIFY.poll()
+        if names and (not w.TAIL or (names - {w.TAIL['filename']})):
+            return True
+    return False
+
+def workerThread(n):
+    """Run due watches' cycles, and follow their live files, until FWTSTOP."""
+    me = 'worker %d' % n
+    idle = 0
+    while not FWTSTOP:
+        try:
+            w = WATCHQ.get(timeout=FOLLOWPOLL)
+        except queue.Empty:
+            continue
+        busy = False
+        setWatch(w)
+        try:
+            uu = _dt.utcut()
+            due = watchDue(w, uu)
+            if due or w.TAIL:
+                W.XLOGDB = SINKPOOL.get()
+                try:
+                    if due:
+                        flushHeartbeats()
+                        runCycle(uu)
+                        busy = True
+                    else:
+                        busy = runProfiled(followTail, cycle=False) > 0
+                finally:
+                    SINKPOOL.put(W.XLOGDB)
+                    W.XLOGDB = None
+        except Exception as E:
+            # Squawked.  This watch is retried next INTERVAL; the others carry on.
+            w.UU = _dt.utcut()
+            _sl.warning('%s: %s: %s' % (me, w.WPATH, E))
+        finally:
+            setWatch(None)
+            WATCHQ.put(w)
+        # Rest after a pass over all the watches with nothing to do.
+        idle = 0 if busy else (idle + 1)
+        if idle >= len(WATCHES):
+            idle = 0
+            time.sleep(FOLLOWPOLL)
+        reportWatches()
+
+def reportWatches(force=False):
+    """Per watch stats (and METRICSFILE), every STATSINTERVAL."""
+    global STATSUU
+    with STATSLOCK:
+        uu = time.time()
+        if not force and (uu - STATSUU) < STATSINTERVAL:
+            return
+        STATSUU = uu
+    if METRICSFILE:
+        try:
+            xlogmetrics.writeFile(METRICSFILE, xlogmetrics.render(collectMetrics()))
+        except Exception as E:
+            _sl.warning('metrics file: %s' % E)
+    for w in WATCHES:
+        _sl.info('{}: cycles {:,d}  new {:,d}  dupe {:,d}  beats {:,d}  backlog {:,d} files {:,d} bytes  {:,.0f} B/s  batch {:,d}  spool {:,d} bytes'.format(
+                 w.WPATH, w.NCYCLES, w.NNEW, w.NDUPE, w.NBEATS, w.NBACKLOG, w.BACKLOGBYTES, w.BACKFILLBPS, batchSize(w), 
+                 w.SPOOL.nbytes if w.SPOOL is not None else 0))
+
+#
+# Metrics: per watch (wpath label) counters, gauges and latency
+# histograms, in the Prometheus text format, served at 
+# http://127.0.0.1:METRICSPORT/metrics and/or rewritten to 
+# METRICSFILE every STATSINTERVAL (xlogmetrics.py).
+#
+METRICSPORT = 0                 # 0: no http endpoint.
+METRICSFILE = None              # None: no stats file.
+
+def collectMetrics():
+    """Return the metric families, for xlogmetrics.render."""
+    fams = collections.OrderedDict()
+    def add(name, typ, hlp, labels, v):
+        fams.setdefault(name, (name, typ, hlp, []))[3].append((labels, v))
+    for w in (WATCHES or [WATCH0]):
+        wl = {'wpath': w.WPATH}
+        for k, n, hlp in (('NNEW', 'new', 'Logrecs inserted into xlog.'),
+                          ('NDUPE', 'dupe', 'Logrecs skipped as already in xlog.'),
+                          ('NMANIFEST', 'manifest_skip', 'Dupes skipped by the file manifest.'),
+                          ('NSHA1HIT', 'sha1_hit', 'Dedup checks answered by the sha1 cache.'),
+                          ('NSHA1MISS', 'sha1_miss', 'Dedup checks asked of the db.'),
+                          ('NBEATS', 'beats', 'Heartbeat logrecs read.'),
+                          ('NOLDBEATS', 'old_beats', 'Heartbeat logrecs superseded in staging.'),
+                          ('NHBWRITES', 'heartbeat_writes', 'Heartbeats written.'),
+                          ('NSPOOLED', 'spooled', 'Logrecs spooled while the sink was down.'),
+                          ('NDRAINED', 'drained', 'Spooled logrecs drained.'),
+                          ('NCYCLES', 'cycles', 'Watch cycles.')):
+            add('xlog2db_%s_total' % n, 'counter', hlp, wl, getattr(w, k))
+        add('xlog2db_backlog_files', 'gauge', 'Unfinished historical files.', wl, w.NBACKLOG)
+        add('xlog2db_backlog_bytes', 'gauge', 'Unprocessed bytes of unfinished historical files.', wl, w.BACKLOGBYTES)
+        add('xlog2db_backfill_bytes_per_second', 'gauge', 'Backfill rate (smoothed).', wl, w.BACKFILLBPS)
+        add('xlog2db_live_lag_bytes', 'gauge', 'Bytes of the live file not yet processed.', wl, w.LIVELAG)
+        add('xlog2db_batch_size', 'gauge', 'Current commit batch size.', wl, batchSize(w))
+        add('xlog2db_spool_bytes', 'gauge', 'Bytes spooled, not yet drained.', wl, w.SPOOL.nbytes if w.SPOOL is not None else 0)
+        add('xlog2db_sink_up', 'gauge', '1 if the sink is up (not spooling).', wl, 0 if w.RETRYAT else 1)
+        for fn, z in list(w.FILEBYTES.items()):
+            add('xlog2db_file_read_bytes_total', 'counter', 'Bytes read, per file.', dict(wl, file=fn), z)
+        for fn, z in list(w.FILELINES.items()):
+            add('xlog2db_file_read_logrecs_total', 'counter', 'Logrecs read, per file.', dict(wl, file=fn), z)
+        qs = w.PIPEQS
+        for x, (k, n) in enumerate((('readq', 'read'), ('writeq', 'write'))):
+            add('xlog2db_pipeline_queue_depth', 'gauge', 'Pipeline queue depth (blocks), now.', dict(wl, queue=n),
+                qs[x].qsize() if qs else 0)
+            add('xlog2db_pipeline_queue_max_depth', 'gauge', 'Pipeline queue max depth (blocks), last run.', dict(wl, queue=n),
+                w.PIPESTATS[k])
+        for k in ('read', 'parse', 'write'):
+            add('xlog2db_pipeline_busy_seconds_total', 'counter', 'Pipeline stage busy time.', dict(wl, stage=k), w.PIPESTATS[k])
+        add('xlog2db_pipeline_blocks_total', 'counter', 'Pipeline blocks written.', wl, w.PIPESTATS['blocks'])
+        add('xlog2db_parse_seconds', 'histogram', 'Parse time per batch (serial: read and parse).', wl, w.HISTS['parse'])
+        add('xlog2db_commit_seconds', 'histogram', 'Sink write and commit time per batch.', wl, w.HISTS['commit'])
+        for k in ('getfis', 'updatedbs', 'oldest', 'moved'):
+            add('xlog2db_stage_seconds', 'histogram', 'Watch cycle stage times.', dict(wl, stage=k), w.HISTS[k])
+    return list(fams.values())
+
+def watchAll():
+    """A thread to run all WATCHES on WATCHERS worker threads."""
+    global FWTRUNNING, FWTSTOP, FWTSTOPPED, WATCHQ
+
+    me = 'watch all'
+    workers = []
+    try:
+        FWTRUNNING = True
+        W.XLOGDB = SINKPOOL.get()                   # WATCH0's, for startup and shutdown.
+        startShared()
+        for w in WATCHES:
+            setWatch(w)
+            watchStart()
+        setWatch(None)
+        WATCHQ = queue.Queue()
+        for w in WATCHES:
+            WATCHQ.put(w)
+        _sl.info('watches: %d, workers: %d, sinks: %d' % (len(WATCHES), max(1, WATCHERS), SINKPOOL.n))
+        for n in range(max(1, WATCHERS)):
+            t = threading.Thread(target=workerThread, args=(n, ), name='xlog2db worker %d' % n)
+            t.start()
+            workers.append(t)
+        while any(t.is_alive() for t in workers):
+            if ONECHECK and all(w.NCYCLES for w in WATCHES):
+                FWTSTOP = True
+            time.sleep(0.1)
+
+    except KeyboardInterrupt as E:
+        _m.beeps(1)
+        msg = '1: {}: KeyboardInterrupt: {}'.format(me, E)
+        _sl.warning(msg)
+        pass
+    except Exception as E:
+        errmsg = '%s: E: %s @ %s' % (me, E, _m.tblineno())
+        DOSQUAWK(errmsg)
+        raise
+    finally:
+        FWTSTOP = True
+        for t in workers:
+            t.join(3 * INTERVAL)
+        try:
+            for w in WATCHES:
+                setWatch(w)
+                w.XLOGDB = WATCH0.XLOGDB
+                try:
+                    watchStop()
+                finally:
+                    w.XLOGDB = None
+            setWatch(None)
+            reportWatches(True)
+        finally:
             FWTSTOPPED = True
-        FFWDB.disconnect()
-        _sl.info('%s exits. STOPPED: %s' % (me, str(FWTSTOPPED)))
-        FWTRUNNING = False
+            stopShared()
+            SINKPOOL.put(W.XLOGDB)
+            W.XLOGDB = None
+            _sl.info('%s exits. STOPPED: %s' % (me, str(FWTSTOPPED)))
+            FWTRUNNING = False
+
+#
+# scanDir: Get the current files' infos, and update FFWDB.
+#
+def scanDir(uu):
+    """Scan WPATH and update FFWDB.  Returns the FileInfo dicts."""
+    t0 = time.perf_counter();
+    fis = getFIs(uu)
+    t1 = time.perf_counter();
+    W.HISTS['getfis'].observe(t1 - t0)
+    if TIMINGS:
+        _sl.warning('   getFIs: {:9,.1f} ms'.format((1000*(t1-t0))))
+    if not fis:
+        return fis
+
+    # Update FFWDB, in one transaction. 
+    # Freshen the "acquired" timestamp.
+    # Delete entries for nonexistent files.
+    # Only new or changed files (and any FFWDB lacks) are updated.
+    t0 = time.perf_counter();
+    filenames = [fi['filename'] for fi in fis]
+    filenames.sort()
+    w = curWatch()
+    with w.FFWDB.batch():
+        for fn in w.FFWDB.acquired(filenames, uu):        # Gone.
+            w.FILEBYTES.pop(fn, None)
+            w.FILELINES.pop(fn, None)
+            if not NOLOAD:
+                delProgress(fn)
+        for fi in fis:
+            if fi['filename'] in w.SCANCHANGED or not w.FFWDB.count(fi['filename']):
+                z = updateDB(fi)
+    t1 = time.perf_counter();
+    w.HISTS['updatedbs'].observe(t1 - t0)
+    if TIMINGS:
+        _sl.warning('updateDBs: {:9,.1f} ms'.format((1000*(t1-t0))))
+    return fis
 
 #
 # getFI
 #
-def getFI(fn, ts):
-    """Return a FileInfo dict for _fn."""
+def getFI(fn, ts, st=None):
+    """Return a FileInfo dict for _fn (given its stat, or stat'ing it)."""
     me = 'getFI(%s)' % repr(fn)
     fi = None
     try:
@@ -814,9 +2308,9 @@ def getFI(fn, ts):
         yymmdd = fn[:6]
         ymd = '20' + yymmdd
         hh = fn[7:9]
-        pfn = os.path.normpath(WPATH + '/' + fn)
+        pfn = os.path.normpath(W.WPATH + '/' + fn)
         try:
-            st    = os.stat(pfn)
+            st    = st or os.stat(pfn)
             size  = st.st_size
             mtime = st.st_mtime
         except Exception as E:
@@ -837,20 +2331,55 @@ def getFI(fn, ts):
         return fi
 
 #
-# getFIs
+# getFIs: Incremental.  WPATH is only listed (by scandir) when 
+#         its mtime has changed (files added, moved or removed).
+#         Otherwise only active files (the newest, and those not
+#         yet finished in FFWDB) are re-stat'd, and the rest are
+#         the previous scan's.  SCANCHANGED is the filenames new
+#         or changed since the previous scan.
 #
+SCANSETTLE = 1.0                # Seconds.  A more recently modified WPATH is always listed.
+
+def scanFinished(fn, w=None):
+    w = w or curWatch()
+    fi = w.FFWDB.select(fn) if w.FFWDB else None
+    return bool(fi) and fi['processed'] >= fi['size']
+
 def getFIs(ts):
     """Return a list of FileInfo dicts of current files."""
     me = 'getFIS'
     fis = []
+    w = curWatch()
     try:
-        for filename in sorted([fn for fn in os.listdir(WPATH) if REFNPATTERN.match(fn)]):
-            fi = getFI(filename, ts)
-            if not fi:
-                continue
+        st = os.stat(w.WPATH)
+        old = w.SCANDIR['fis'] if (w.SCANDIR and w.SCANDIR['wpath'] == w.WPATH) else {}
+        same = bool(old) and w.SCANDIR['mtime'] == st.st_mtime_ns and (time.time() - st.st_mtime) > SCANSETTLE
+        if same:
+            entries = None
+            filenames = sorted(old)
+        else:
+            entries = {e.name: e for e in os.scandir(w.WPATH) if REFNPATTERN.match(e.name)}
+            filenames = sorted(entries)
+        newest = filenames[-1] if filenames else None
+        new, changed = {}, set()
+        for filename in filenames:
+            ofi = old.get(filename)
+            if same and filename != newest and scanFinished(filename, w):
+                fi = ofi
+                fi['acquired'] = ts
+            else:
+                fi = getFI(filename, ts, entries[filename].stat() if entries else None)
+                if not fi:
+                    continue
+                if not (ofi and ofi['size'] == fi['size'] and ofi['modified'] == fi['modified']):
+                    changed.add(filename)
+            new[filename] = fi
             fis.append(fi)
+        w.SCANDIR = {'wpath': w.WPATH, 'mtime': st.st_mtime_ns, 'fis': new}
+        w.SCANCHANGED = changed
     except Exception as E:
         fis = None              # ??? Zap all?
+        w.SCANDIR = None
         errmsg = '%s: %s @ %s' % (me, E, _m.tblineno())
         DOSQUAWK(errmsg)
         raise
@@ -861,37 +2390,65 @@ def getFIs(ts):
 # main: xlog2db
 #
 def xlog2db():
-    global SRCID, SUBID, WPATH, DONESD, INTERVAL
-    global FFWDBPFN, FWTSTOP, FWTSTOPPED, XLOGDB
+    global SRCID, SUBID, INTERVAL, DBCFG
+    global FWTSTOP, FWTSTOPPED
+    global WATCHES, WATCHERS, SINKS, SINKPOOL, WRITERS, METRICSPORT, METRICSFILE
     me, action = 'xlog2db', ''
+    watcher_thread = None
     try:
         _sl.info(me + ' begins')#$#
         SRCID = _a.ARGS['--srcid']
         SUBID = _a.ARGS['--subid']
-        WPATH = _a.ARGS['--wpath'].rstrip('/').rstrip('/')
+        WPATHS = [z.strip().rstrip('/').rstrip('/') for z in _a.ARGS['--wpath'].split(',') if z.strip()]
         DONESD = _a.ARGS['--donesd']
         INTERVAL = float(_a.ARGS['--interval'])
         DBCFG = _a.ARGS['--xlogdb']         # DB connection configuration, as a string.
         DBCFG = eval(DBCFG)                 # ..., as a dict.
+        WATCHERS = int(_a.ARGS.get('--watchers') or WATCHERS)
+        SINKS = int(_a.ARGS.get('--sinks') or SINKS)
+        WRITERS = int(_a.ARGS.get('--writers') or WRITERS)
+        z = _a.ARGS.get('--metrics')
+        if z and z.isdigit():
+            METRICSPORT = int(z)
+        elif z:
+            METRICSFILE = z
 
         _sl.info()
         _sl.info('    srcid: ' + SRCID)
         _sl.info('    subid: ' + SUBID)
-        _sl.info('    wpath: ' + WPATH)
-        _sl.info('  done sd: ' + DONESD)
+        for z in WPATHS:
+            _sl.info('    wpath: ' + z)
+        _sl.info('  done sd: ' + str(DONESD))
         _sl.info(' interval: ' + str(INTERVAL))
         _sl.info('   db cfg: ' + repr(DBCFG))
+        if len(WPATHS) > 1:
+            _sl.info(' watchers: ' + str(WATCHERS))
+            _sl.info('    sinks: ' + str(SINKS or WATCHERS))
+        if WRITERS > 1:
+            _sl.info('  writers: ' + str(WRITERS))
+        if METRICSPORT or METRICSFILE:
+            _sl.info('  metrics: ' + str(METRICSPORT or METRICSFILE))
         _sl.info()
 
-        # FFW DB PFN.  DB creation must be done in watcherThread.
-        FFWDBPFN = os.path.normpath(WPATH + '/xlog2db.s3')
+        # Sink dbs: MySQL, or (driver 'SQLITE') a local file.
+        SINKPOOL = xlogsink.SinkPool(DBCFG, SINKS or WATCHERS, BULKBACKFILL)
 
-        # Open sink db.
-        XLOGDB = mc.connect(host=DBCFG['host'], user=DBCFG['user'], password=DBCFG['password'], db=DBCFG['database'], raise_on_warnings=True)
+        # One watch per wpath.  FFW DB creation must be done in the 
+        # watching thread(s).
+        if len(WPATHS) == 1:
+            WATCH0.__init__(WPATHS[0], DONESD)
+            WATCHES = [WATCH0]
+            W.XLOGDB = SINKPOOL.get()
+            target = watcherThread
+        else:
+            WATCHES = [Watch(z, DONESD) for z in WPATHS]
+            target = watchAll
+        if METRICSPORT:
+            xlogmetrics.serve(METRICSPORT, collectMetrics)
 
         # Start watcher() in a thread.
 
-        watcher_thread = threading.Thread(target=watcherThread)
+        watcher_thread = threading.Thread(target=target)
         watcher_thread.start()
         # Wait for startup.
         while not FWTRUNNING:           
@@ -929,15 +2486,15 @@ if __name__ == '__main__':
 
         SRCID = 'xlog'
         SUBID = '2db_'
-        DONESD = None
+        W.DONESD = None
         INTERVAL = 6
 
-        WPATH = 'c:/xlog/test'
-        FFWDBPFN = os.path.normpath(WPATH + '/xlog2db.s3')
-        FFWDB = ffwdb.FFWDB(FFWDBPFN)
+        W.WPATH = 'c:/xlog/test'
+        W.FFWDBPFN = os.path.normpath(W.WPATH + '/xlog2db.s3')
+        W.FFWDB = ffwdb.FFWDB(W.FFWDBPFN)
 
         DBCFG = {'driver': 'MYSQLDIRECT', 'user': 'root', 'password': 'woofuswoofus', 'host': '192.168.100.5', 'database': 'XLOG'}
-        XLOGDB = mc.connect(host=DBCFG['host'], user=DBCFG['user'], password=DBCFG['password'], db=DBCFG['database'], raise_on_warnings=True)
+        W.XLOGDB = xlogsink.makeSink(DBCFG, BULKBACKFILL)
 
         logrec = ownHeartbeat()
         addHeartbeat(logrec)
@@ -948,7 +2505,7 @@ if __name__ == '__main__':
         testfn = '151213-02.log'    #  48,894 bytes.
         historical = False
 
-        testfi = FFWDB.select(testfn)
+        testfi = W.FFWDB.select(testfn)
         ###!!!testfi['processed'] = 0
 
         # 1/2: Optionally append stuff to logfile to 
@@ -963,7 +2520,7 @@ if __name__ == '__main__':
             fis = getFIs(uu)
             filenames = [fi['filename'] for fi in fis]
             filenames.sort()
-            FFWDB.acquired(filenames, uu)
+            W.FFWDB.acquired(filenames, uu)
             for fi in fis:
                 if fi['filename'] == testfn:
                     testfi = updateDB(fi)
@@ -976,10 +2533,10 @@ if __name__ == '__main__':
 
     # Test 2.
     if False:
-        WPATH = 'c:/xlog/test/'
-        DONESD = 'XL2DB'
-        FFWDBPFN = os.path.normpath(WPATH + '/xlog2db.s3')
-        FFWDB = ffwdb.FFWDB(FFWDBPFN)
+        W.WPATH = 'c:/xlog/test/'
+        W.DONESD = 'XL2DB'
+        W.FFWDBPFN = os.path.normpath(W.WPATH + '/xlog2db.s3')
+        W.FFWDB = ffwdb.FFWDB(W.FFWDBPFN)
         fn = '151207-19.log'
         doneWithFile(fn)
         doneWithFile(fn)
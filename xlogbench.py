@@ -0,0 +1,287 @@
+#> !P3!
+
+###
+### xlogbench:
+###
+###     Synthetic XLOG flatfiles, and throughput benchmarks of
+###       xlog2db against them.
+###     --gen writes "YYMMDD-HH.log" files to a folder, in the
+###       NEW (tab), OLD ('|') or mixed formats, with a given
+###       access/error/heartbeat mix and duplicate ratio.
+###     Otherwise, files are generated in a work folder and these
+###       are timed:
+###         parse:  exportFile with NOLOAD (serial, PIPELINE and,
+###                 with --workers, the BACKFILLWORKERS pool).
+###         scan:   scanDir (getFIs and FFWDB updates) over a
+###                 folder of --scanfiles files, cold and steady.
+###         load:   exportFile into a local SQLiteSink, fresh and
+###                 then rerun (all dupes), normally, BULKBACKFILL and,
+###                 with --writers, by parallel WRITERS.
+###     Results are printed, and written to --json, as JSON so
+###       versions can be compared.
+###
+
+"""
+Usage:
+  xlogbench.py [--work=<work> --json=<json> --only=<only> --files=<files> --lines=<lines> --mix=<mix> --dupes=<dupes> --format=<format> --scanfiles=<scanfiles> --workers=<workers> --writers=<writers>]
+  xlogbench.py --gen=<wpath> [--files=<files> --lines=<lines> --mix=<mix> --dupes=<dupes> --format=<format>]
+  xlogbench.py (-h | --help)
+
+Options:
+  -h --help                Show help.
+  --gen=<wpath>            Just generate files into wpath.
+  --work=<work>            Work folder [default: xlogbench.wrk].
+  --json=<json>            Results file (JSON).
+  --only=<only>            Comma list of: parse, scan, load [default: parse,scan,load].
+  --files=<files>          Files to generate [default: 4].
+  --lines=<lines>          Logrecs per file [default: 50000].
+  --mix=<mix>              Access, error, heartbeat weights [default: 80,15,5].
+  --dupes=<dupes>          Ratio of repeated logrecs [default: 0.02].
+  --format=<format>        new, old or mixed [default: new].
+  --scanfiles=<scanfiles>  Files for the scan benchmark [default: 10000].
+  --workers=<workers>      Backfill worker processes for parse [default: 0].
+  --writers=<writers>      Parallel writers for load [default: 0].
+"""
+
+import os, sys
+import time, datetime
+import shutil
+import json
+import hashlib
+import random
+import platform
+
+from docopt import docopt
+
+####################################################################################################
+
+# Generator.
+
+SRCIDS = ('nx01', 'nx02', 'nx03', 'ap01')
+UAS = ('Mozilla/5.0 (Windows NT 5.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/42.0.2311.90 Safari/537.36',
+       'Mozilla/5.0 (X11; Linux x86_64; rv:38.0) Gecko/20100101 Firefox/38.0',
+       'curl/7.35.0')
+REQUESTS = ('GET / HTTP/1.1', 'GET /favicon.ico HTTP/1.1', 'POST /api/v1/xlog HTTP/1.1', 'GET /cgi-bin/php HTTP/1.1')
+
+def _ts(u):
+    return '%15.4f' % u
+
+def genKVs(rng, ae, srcid, u):
+    """A logrec's kvs dict, after the examples in xlog2db."""
+    kvs = {'_el': '0', '_id': srcid, '_ip': '192.168.100.%d' % rng.randint(2, 250), '_si': '____',
+           '_sl': ae, '_ts': _ts(u), 'ae': ae}
+    if   ae == 'a':
+        kvs.update({'body_bytes_sent': rng.randint(0, 50000), 'http_referer': None,
+                    'http_user_agent': rng.choice(UAS),
+                    'remote_addr': '%d.%d.%d.%d' % tuple(rng.randint(1, 254) for _ in range(4)),
+                    'remote_user': None, 'request': rng.choice(REQUESTS),
+                    'status': rng.choice((200, 200, 200, 304, 404)),
+                    'time_local': time.strftime('[%d/%b/%Y:%H:%M:%S -0700]', time.gmtime(u)),
+                    'time_utc': int(u)})
+    elif ae == 'e':
+        kvs.update({'status': '[error]',
+                    'stuff': '2697#0:\t*%d\topen()\t"/var/www/cgi-bin/php"\tfailed\t(2:\tNo\tsuch\tfile\tor\tdirectory)' % rng.randint(1, 9999),
+                    'time_local': time.strftime('%Y/%m/%d %H:%M:%S', time.gmtime(u)),
+                    'time_utc': int(u)})
+    else:
+        kvs.update({'dt_loc': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(u)),
+                    'dt_utc': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(u))})
+    return kvs
+
+def genLogrec(rng, ae, srcid, u, fmt):
+    el, sl = '0', ('h' if ae == 'h' else ae)
+    kvsa = json.dumps(genKVs(rng, ae, srcid, u), ensure_ascii=True, sort_keys=True)
+    sha1 = hashlib.sha1(kvsa.encode()).hexdigest()
+    rxts, txts = _ts(u + rng.random() / 10), _ts(u)
+    if fmt == 'old':
+        return '|'.join((rxts, txts, srcid, el, sl, sha1, kvsa)) + '\n'
+    return '\t'.join(('1', rxts, txts, srcid, '____', el, sl, sha1, kvsa)) + '\n'
+
+def genFiles(wpath, nfiles, nlines, mix, dupes, fmt, seed=1):
+    """Write nfiles hourly logfiles of nlines logrecs to wpath.  Returns filenames."""
+    rng = random.Random(seed)
+    os.makedirs(wpath, exist_ok=True)
+    aes, ws = ('a', 'e', 'h'), [float(z) for z in mix.split(',')]
+    u0 = 1449936000.0                                   # 2015-12-12 16:00 UTC.
+    recent, fns = [], []
+    for x in range(nfiles):
+        u = u0 + 3600 * x
+        fn = time.strftime('%y%m%d-%H.log', time.gmtime(u))
+        z = fmt if fmt != 'mixed' else ('new', 'old')[x % 2]
+        with open(os.path.join(wpath, fn), 'w', encoding='utf-8') as f:
+            for y in range(nlines):
+                if recent and rng.random() < dupes:
+                    f.write(rng.choice(recent))
+                    continue
+                ae = rng.choices(aes, ws)[0]
+                logrec = genLogrec(rng, ae, rng.choice(SRCIDS), u + y * 3600.0 / nlines, z)
+                f.write(logrec)
+                if ae != 'h':
+                    recent.append(logrec)
+                    if len(recent) > 1000:
+                        recent.pop(0)
+        fns.append(fn)
+    return fns
+
+####################################################################################################
+
+# Benchmarks.
+
+def _reset(X):
+    """A fresh watch (stats, staging), keeping its wpath, FFWDB and sink."""
+    X.closeTail()
+    w = X.Watch(X.W.WPATH)
+    w.FFWDB, w.XLOGDB = X.W.FFWDB, X.W.XLOGDB
+    X.setWatch(w)
+    X.HBCACHE = None
+
+def _export(X, wpath, uu):
+    """Export every file in wpath (all historical).  Returns (bytes, seconds)."""
+    X.W.WPATH = wpath
+    nb = 0
+    t0 = time.perf_counter()
+    X.scanDir(uu)
+    for fi in X.W.FFWDB.listing('u'):
+        nb += fi['size'] - fi['processed']
+        X.exportFile(True, fi)
+    return nb, time.perf_counter() - t0
+
+def benchParse(X, ffwdb, args, wpath, nlines):
+    results = {}
+    variants = [('serial', {}), ('pipeline', {'PIPELINE': True})]
+    workers = int(args['--workers'])
+    if workers > 1:
+        variants.append(('pool', {'BACKFILLWORKERS': workers}))
+    for name, settings in variants:
+        _reset(X)
+        X.NOLOAD, X.W.XLOGDB, X.PIPELINE, X.BACKFILLWORKERS, X.POOL = True, None, False, 0, None
+        for k, v in settings.items():
+            setattr(X, k, v)
+        if X.BACKFILLWORKERS > 1:
+            import multiprocessing
+            X.POOL = multiprocessing.Pool(X.BACKFILLWORKERS)
+        X.W.FFWDB = ffwdb.FFWDB(':memory:')
+        try:
+            nb, t = _export(X, wpath, time.time())
+        finally:
+            X.W.FFWDB.disconnect()
+            if X.POOL:
+                X.POOL.terminate()
+                X.POOL = None
+        results[name] = {'bytes': nb, 'seconds': t, 'MBps': nb / t / 2**20, 'lps': nlines / t, 'beats': X.W.NBEATS}
+    X.PIPELINE, X.BACKFILLWORKERS = False, 0
+    return results
+
+def benchScan(X, ffwdb, work, nfiles, cycles=5):
+    spath = os.path.join(work, 'scan')
+    shutil.rmtree(spath, ignore_errors=True)
+    os.makedirs(spath)
+    u0 = 946684800.0                                    # 2000-01-01.
+    for x in range(nfiles):
+        fn = time.strftime('%y%m%d-%H.log', time.gmtime(u0 + 3600 * x))
+        with open(os.path.join(spath, fn), 'w') as f:
+            f.write('\n')
+    _reset(X)
+    X.W.WPATH = spath
+    X.W.FFWDB = ffwdb.FFWDB(os.path.join(work, 'scan.s3'))
+    settle, X.SCANSETTLE = getattr(X, 'SCANSETTLE', None), 0
+    ts = []
+    try:
+        for x in range(1 + cycles):
+            t0 = time.perf_counter()
+            fis = X.scanDir(time.time())
+            ts.append(1000 * (time.perf_counter() - t0))
+            if x == 0:                                  # History: all but the newest are finished.
+                with X.W.FFWDB.batch():
+                    for fi in fis[:-1]:
+                        X.W.FFWDB.update({'filename': fi['filename'], 'processed': fi['size']})
+    finally:
+        X.SCANSETTLE = settle
+        X.W.FFWDB.disconnect()
+        os.remove(os.path.join(work, 'scan.s3'))
+    return {'files': nfiles, 'cold_ms': ts[0], 'steady_ms': sum(ts[1:]) / cycles, 'cycles': cycles}
+
+def benchLoad(X, ffwdb, xlogsink, work, wpath, writers=0):
+    results = {}
+    X.NOLOAD, X.PIPELINE, X.BACKFILLWORKERS, X.POOL = False, False, 0, None
+    X.SRCID, X.SUBID = 'xlog', 'bnch'
+    variants = [('', False, 0), ('bulk_', True, 0)]
+    if writers > 1:
+        variants.append(('writers_', False, writers))
+    for prefix, bulk, writers in variants:
+        pfn = os.path.join(work, 'xlog.s3')
+        for z in (pfn, pfn + '-wal', pfn + '-shm'):
+            if os.path.exists(z):
+                os.remove(z)
+        X.BULKBACKFILL, X.WRITERS = bulk, writers
+        X.DBCFG = {'driver': 'SQLITE', 'database': pfn}
+        X.W.XLOGDB = xlogsink.SQLiteSink(pfn)
+        X.W.FFWDB = ffwdb.FFWDB(os.path.join(work, 'load.s3'))
+        X.startWriters()
+        try:
+            for name in ('fresh', 'rerun'):
+                _reset(X)
+                X.seedSHA1Cache(time.time())
+                for fi in X.W.FFWDB.listing('a'):       # Rerun from scratch.
+                    X.W.FFWDB.delete(fi['filename'])
+                    X.delProgress(fi['filename'])
+                nb, t = _export(X, wpath, time.time())
+                nr = X.W.NNEW + X.W.NDUPE
+                results[prefix + name] = {
+                    'bytes': nb, 'seconds': t, 'rows': nr, 'rps': nr / t,
+                    'new': X.W.NNEW, 'dupe': X.W.NDUPE, 'sha1hit': X.W.NSHA1HIT, 'sha1miss': X.W.NSHA1MISS,
+                    'batch': X.batchSize()}
+        finally:
+            X.stopWriters()
+            X.W.FFWDB.disconnect()
+            X.W.XLOGDB.close()
+            X.W.XLOGDB = None
+            X.BULKBACKFILL, X.WRITERS = False, 0
+            os.remove(os.path.join(work, 'load.s3'))
+    return results
+
+####################################################################################################
+
+def xlogbench(args):
+    nfiles, nlines = int(args['--files']), int(args['--lines'])
+    gen = lambda wpath: genFiles(wpath, nfiles, nlines, args['--mix'], float(args['--dupes']), args['--format'])
+    if args['--gen']:
+        for fn in gen(args['--gen']):
+            print(fn)
+        return
+
+    # xlog2db parses its own args on import.
+    sys.argv = sys.argv[:1]
+    import xlog2db as X
+    import ffwdb
+    import xlogsink
+    X.TIMINGS, X.FOLLOW = False, False
+
+    work = os.path.abspath(args['--work'])
+    wpath = os.path.join(work, 'logs')
+    shutil.rmtree(wpath, ignore_errors=True)
+    gen(wpath)
+
+    only = args['--only'].split(',')
+    results = {}
+    if 'parse' in only:
+        results['parse'] = benchParse(X, ffwdb, args, wpath, nfiles * nlines)
+    if 'scan' in only:
+        results['scan'] = benchScan(X, ffwdb, work, int(args['--scanfiles']))
+    if 'load' in only:
+        results['load'] = benchLoad(X, ffwdb, xlogsink, work, wpath, int(args['--writers'] or 0))
+
+    report = {'bench': 'xlogbench',
+              'when': datetime.datetime.utcnow().isoformat() + 'Z',
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'params': {k.lstrip('-'): v for k, v in args.items() if k.startswith('--') and v is not None},
+              'results': results}
+    z = json.dumps(report, indent=2, sort_keys=True)
+    print(z)
+    if args['--json']:
+        with open(args['--json'], 'w') as f:
+            f.write(z + '\n')
+
+if __name__ == '__main__':
+    xlogbench(docopt(__doc__))
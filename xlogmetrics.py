@@ -0,0 +1,99 @@
+
+# *** XLOG2DB version ***
+
+# Metrics, in the Prometheus text exposition format, served on
+# a local http port (GET /metrics) or rewritten to a stats file.
+# xlog2db supplies a collect() returning families:
+#   (name, type, help, [(labels dict, value), ...])
+# with type 'counter' or 'gauge', or, for a 'histogram', values
+# that are Histograms.
+
+import os
+import threading
+import http.server
+
+LATENCYBUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Seconds.
+
+class Histogram():
+
+    def __init__(self, buckets=LATENCYBUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)         # Last is +Inf.
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, v):
+        x = 0
+        while x < len(self.buckets) and v > self.buckets[x]:
+            x += 1
+        with self.lock:
+            self.counts[x] += 1
+            self.sum += v
+            self.count += 1
+
+def _labels(labels, more=None):
+    z = dict(labels or {})
+    z.update(more or {})
+    if not z:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                             for k, v in sorted(z.items()))
+
+def _num(v):
+    if v == float('inf'):
+        return '+Inf'
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+def render(families):
+    """Return families as exposition text."""
+    ls = []
+    for name, typ, hlp, samples in families:
+        ls.append('# HELP %s %s' % (name, hlp))
+        ls.append('# TYPE %s %s' % (name, typ))
+        for labels, v in samples:
+            if typ != 'histogram':
+                ls.append('%s%s %s' % (name, _labels(labels), _num(v)))
+                continue
+            with v.lock:
+                counts, s, n = list(v.counts), v.sum, v.count
+            z = 0
+            for le, c in zip(v.buckets + (float('inf'), ), counts):
+                z += c
+                ls.append('%s_bucket%s %d' % (name, _labels(labels, {'le': _num(le)}), z))
+            ls.append('%s_sum%s %s' % (name, _labels(labels), _num(s)))
+            ls.append('%s_count%s %d' % (name, _labels(labels), n))
+    return '\n'.join(ls) + '\n'
+
+def writeFile(pfn, text):
+    """Atomically replace pfn with text."""
+    z = pfn + '.tmp'
+    with open(z, 'w', encoding='utf-8', newline='\n') as f:
+        f.write(text)
+    os.replace(z, pfn)
+
+def serve(port, collect, host='127.0.0.1'):
+    """Serve render(collect()) at http://host:port/metrics, from a daemon thread.  Returns the server."""
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            try:
+                z = render(collect()).encode('utf-8')
+            except Exception as E:
+                self.send_error(500, str(E))
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(z)))
+            self.end_headers()
+            self.wfile.write(z)
+        def log_message(self, *args):
+            pass                                # Quiet.
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='xlog2db metrics', daemon=True).start()
+    return server
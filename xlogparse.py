@@ -0,0 +1,211 @@
+
+# *** XLOG2DB version ***
+
+# Logrec parsing, shared by xlog2db and its backfill worker
+# processes (which import just this module).
+# See xlog2db for the logrec layout.
+# bytes2row is the fast path: it parses a raw (bytes) logrec
+# once, into a tuple ready for insertion.
+# parseRange parses the logrecs that start in a byte range of
+# a file, so a historical file can be split across processes.
+# Ranges needn't be aligned: each logrec belongs to the range
+# its first byte is in.
+
+ENCODING = 'utf-8'              # As xlog2db.
+ERRORS = 'strict'
+
+HB_EL, HB_SL = '0', 'h'         # !MAGIC! Heartbeat error level, sub level.
+
+def _S(x):
+    if   isinstance(x, bytes):
+        return x.decode(encoding=ENCODING, errors=ERRORS)
+    elif x is None:
+        return None
+    elif isinstance(x, bool):
+        return '1' if x else '0'
+    else:
+        return str(x)
+
+#
+# logrec2fields
+#
+def logrec2fields(logrec):
+    """Extract fields (which must exist, except when logrec is a ';' comment) from logrec."""
+    fv = rxts = txts = srcid = subid = el = sl = sha1 = kvs = None
+    try:
+        # Comment?
+        if logrec[0] == ';':
+            kvs = logrec;                       # (ab)Use kvs field.
+            return
+        # Format value?
+        if logrec[1] == '\t' and logrec[0].isdigit():
+            fv = int(logrec[0])
+            if  fv == 1:
+                nt = logrec.count('\t')
+                if nt == 9:             # To handle a redundant sl in older preambles.
+                    (rxts, txts, srcid, subid, z, el, sl, sha1, kvs) = logrec[2:].split('\t', 8)
+                    raise ValueError('bad extra z (%s) vs sl (%s)' % (repr(z), repr(sl)))
+                else:
+                    (rxts, txts, srcid, subid, el, sl, sha1, kvs) = logrec[2:].split('\t', 7)
+            else:
+                raise ValueError('bad ffv: %d' % fv)
+        else:
+            fv, subid = 0, '____'                                           # !MAGIC! defaults.
+            (rxts, txts, srcid, el, sl, sha1, kvs) = logrec.split('|', 6)
+    finally:
+        try:    sha1 = sha1.lower()     # Safety.
+        except: sha1 = None
+        return (fv, rxts, txts, srcid, subid, el, sl, sha1, kvs)
+
+#
+# logrec2row: Classify and convert a logrec.
+#   (None, None)    blank
+#   ('c', comment)  ';' comment
+#   ('h', logrec)   heartbeat (to be staged)
+#   ('x', loadrec)  for XLOG:xlog
+#
+def logrec2row(logrec):
+    try:    logrec = logrec.rstrip()    # No \n.
+    except: logrec = None
+    if not logrec:
+        return (None, None)
+
+    # Split logrec to fields.
+    (fv, rxts, txts, srcid, subid, el, sl, sha1, kvs) = logrec2fields(logrec)
+    if fv is None:
+        return ('c', kvs) if kvs else (None, None)
+    float(rxts), float(txts)                # Validated, but kept as they came.
+
+    # Heartbeat?
+    if el == HB_EL and sl == HB_SL:
+        return ('h', logrec)
+
+    return ('x', [rxts.strip(), txts.strip(), _S(srcid), _S(subid), _S(el), _S(sl), _S(sha1), _S(kvs)])  # !!! Matches xlog table.
+
+#
+# bytes2row: As logrec2row, for a raw (undecoded) logrec, and 
+#            ('h', loadrec) for a heartbeat.  Loadrecs are tuples.
+#            The older 9-tab preamble's redundant field is dropped.
+#            The line is decoded once, in one go: decoding its 
+#            fields one by one is slower (kvs is most of it, and
+#            is needed as str anyway).  rxts and txts are checked
+#            by float(), but kept as they came (stripped).
+#
+def bytes2row(logrec):
+    logrec = logrec.decode(encoding=ENCODING, errors=ERRORS).rstrip()
+    if not logrec:
+        return (None, None)
+    c0 = logrec[0]
+    # Comment?
+    if c0 == ';':
+        return ('c', logrec)
+    # Format value?
+    if logrec[1:2] == '\t' and '0' <= c0 <= '9':
+        if c0 != '1':
+            raise ValueError('bad ffv: %s' % c0)
+        fs = logrec[2:].split('\t', 8)
+        if len(fs) == 9 and len(fs[7]) == 40:               # Older preamble: redundant field.
+            (rxts, txts, srcid, subid, z, el, sl, sha1, kvs) = fs
+        else:
+            (rxts, txts, srcid, subid, el, sl, sha1, kvs) = logrec[2:].split('\t', 7)
+    else:
+        (rxts, txts, srcid, el, sl, sha1, kvs) = logrec.split('|', 6)
+        subid = '____'                                      # !MAGIC! default.
+    float(rxts), float(txts)
+    row = (rxts.strip(), txts.strip(), srcid, subid, el, sl, sha1.lower(), kvs)    # !!! Matches xlog table.
+    return ('h' if (el == HB_EL and sl == HB_SL) else 'x', row)
+
+#
+# ranges: Split [start, end) into n nominal ranges of at least minsize.
+#
+def ranges(start, end, n, minsize=2**20):
+    n = max(1, min(n, (end - start) // minsize))
+    z = (end - start) // n
+    rs = []
+    for x in range(n):
+        a = start + x * z
+        b = end if x == (n - 1) else (a + z)
+        rs.append((a, b))
+    return rs
+
+#
+# parseRange: Worker.
+#
+def parseRange(args):
+    """Parse the logrecs starting in [start, end) of pfn.  Returns a list of
+       (loadrecs, heartbeats, comments, endofs) blocks of up to batchsize loadrecs,
+       endofs being the offset just past each block's last logrec."""
+    pfn, start, end, historical, batchsize = args
+    blocks = []
+    lrs, hbs, cms = [], [], []
+    with open(pfn, 'rb') as f:
+        # Skip the tail of a logrec that started in the previous range.
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+        offset = f.tell()
+        while offset < end:
+            line = f.readline()
+            if not line:
+                break
+            if not line.endswith(b'\n') and not historical:
+                break                               # Partial: not yet.
+            offset += len(line)
+            kind, z = bytes2row(line)
+            if   kind == 'x':
+                lrs.append(z)
+            elif kind == 'h':
+                hbs.append(z)
+            elif kind == 'c':
+                cms.append(z)
+            if len(lrs) >= batchsize:
+                blocks.append((lrs, hbs, cms, offset))
+                lrs, hbs, cms = [], [], []
+    if lrs or hbs or cms or not blocks:
+        blocks.append((lrs, hbs, cms, offset))
+    return blocks
+
+if __name__ == '__main__':
+
+    # Micro-benchmark: bytes2row vs. decode + logrec2row (logrec2fields,
+    # float, _S) in logrecs per second, on given files or synthetic logrecs.
+    #   python xlogparse.py [yymmdd-hh.log ...]
+
+    import sys, time, json, hashlib
+
+    lines = []
+    for pfn in sys.argv[1:]:
+        with open(pfn, 'rb') as f:
+            lines.extend(f.readlines())
+    if not lines:
+        for x in range(100000):
+            kvs = json.dumps({'_id': 'nx01', '_si': '____', '_el': '0', '_sl': 'a', '_ts': '1449937065.5425', 
+                              'n': x, 'request': 'GET / HTTP/1.1', 'status': 200}, sort_keys=True)
+            sha1 = hashlib.sha1(kvs.encode()).hexdigest()
+            if x % 2:
+                lines.append(('1\t1449937065.5425\t1429603009.    \tnx01\t____\t0\ta\t%s\t%s\n' % (sha1, kvs)).encode())
+            else:
+                lines.append(('1449937065.5425|1429603009.    |nx01|0|a|%s|%s\n' % (sha1, kvs)).encode())
+
+    def old():
+        for line in lines:
+            logrec2row(line.decode(encoding=ENCODING, errors=ERRORS))
+
+    def new():
+        for line in lines:
+            bytes2row(line)
+
+    # Same loadrecs?
+    for line in lines[:1000]:
+        a, b = logrec2row(line.decode(encoding=ENCODING, errors=ERRORS)), bytes2row(line)
+        if a[0] == 'x':
+            assert tuple(a[1]) == b[1], (a, b)
+
+    for name, fn in (('logrec2row', old), ('bytes2row', new)):
+        t = None
+        for x in range(7):                  # Best of.
+            t0 = time.perf_counter()
+            fn()
+            t1 = time.perf_counter()
+            t = (t1 - t0) if t is None else min(t, t1 - t0)
+        print('{:>12s}: {:12,.0f} logrecs/s'.format(name, len(lines) / t))
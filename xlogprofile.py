@@ -0,0 +1,116 @@
+
+# *** XLOG2DB version ***
+
+# Profiling, toggled at runtime by xlog2db (see its PROFILEFLAG).
+# CycleProfiler: cProfile over a number of watcher cycles, run by
+# whichever threads run them, merged into one pstats report.
+# Runs that aren't counted as cycles (live file follows between
+# them) are merged in too.
+# (cProfile sees only the thread it's enabled in, and one at a
+# time: a cycle run while another's being profiled isn't.)
+# Sampler: a thread that samples all the other threads' stacks
+# every interval, aggregated as collapsed stacks, one
+#   thread;file:function;...;file:function count
+# per line, for flamegraph.pl (or speedscope, ...).
+
+import os
+import io
+import sys
+import time
+import threading
+import cProfile
+import pstats
+
+class CycleProfiler():
+
+    def __init__(self, ncycles):
+        self.ncycles = ncycles
+        self.ndone = 0
+        self.stats = None               # pstats.Stats, merged.
+        self.lock = threading.Lock()    # Held while a cycle's profiled.
+
+    @property
+    def done(self):
+        return self.ndone >= self.ncycles
+
+    def run(self, fn, *args, count=True):
+        """Return fn(*args), profiled if none other is.  count: it's a cycle."""
+        if self.done or not self.lock.acquire(blocking=False):
+            return fn(*args)
+        try:
+            p = cProfile.Profile()
+            p.enable()
+            try:
+                return fn(*args)
+            finally:
+                p.disable()
+                if self.stats is None:
+                    self.stats = pstats.Stats(p)
+                else:
+                    self.stats.add(p)
+                if count:
+                    self.ndone += 1
+        finally:
+            self.lock.release()
+
+    def write(self, pfnx, top=40):
+        """Write pfnx.pstats (for pstats, snakeviz, ...) and a pfnx.txt report.  Returns the pfns."""
+        with self.lock:
+            if self.stats is None:
+                return []
+            self.stats.dump_stats(pfnx + '.pstats')
+            z = io.StringIO()
+            self.stats.stream = z
+            z.write('%d cycles\n\n' % self.ndone)
+            self.stats.sort_stats('cumulative').print_stats(top)
+            self.stats.sort_stats('tottime').print_stats(top)
+            with open(pfnx + '.txt', 'w', encoding='utf-8') as f:
+                f.write(z.getvalue())
+            return [pfnx + '.pstats', pfnx + '.txt']
+
+def _frame(f):
+    return '%s:%s' % (os.path.basename(f.f_code.co_filename), f.f_code.co_name)
+
+class Sampler():
+
+    def __init__(self, seconds, interval=0.005):
+        self.seconds = seconds
+        self.interval = interval
+        self.stacks = {}                # {collapsed stack: samples}
+        self.nsamples = 0
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.sample, name='xlog2db sampler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    @property
+    def done(self):
+        return not self.thread.is_alive()
+
+    def sample(self):
+        me = threading.get_ident()
+        t1 = time.monotonic() + self.seconds
+        while not self.stop.wait(self.interval) and time.monotonic() < t1:
+            names = dict((t.ident, t.name) for t in threading.enumerate())
+            for ident, f in sys._current_frames().items():
+                if ident == me:
+                    continue
+                z = []
+                while f is not None:
+                    z.append(_frame(f))
+                    f = f.f_back
+                z.append(names.get(ident, str(ident)).replace(';', ':'))
+                k = ';'.join(reversed(z))
+                self.stacks[k] = self.stacks.get(k, 0) + 1
+            self.nsamples += 1
+
+    def write(self, pfnx):
+        """Stop, and write pfnx.collapsed.  Returns the pfns."""
+        self.stop.set()
+        if self.thread.ident is not None:
+            self.thread.join()
+        with open(pfnx + '.collapsed', 'w', encoding='utf-8', newline='\n') as f:
+            for k, n in sorted(self.stacks.items()):
+                f.write('%s %d\n' % (k, n))
+        return [pfnx + '.collapsed']
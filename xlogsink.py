@@ -0,0 +1,480 @@
+
+# *** XLOG2DB version ***
+
+# Sinks: where xlog2db's rows go.
+# A Sink covers what xlog2db asks of the XLOG database: bulk
+# insertion of xlog rows, dedup lookup by sha1, heartbeat
+# upserts (newer by txts only), per file progress checkpoints,
+# and commit.  Nothing is committed until commit(), so a batch
+# and its checkpoint share a transaction.
+# MySQLSink is the XLOG server (mysql.connector, imported only
+# when used).  SQLiteSink is a local file, for edge boxes with
+# no MySQL server, and for local load tests.
+# bulkload is for backfills: rows (unique by sha1) are staged
+# in a temporary table (MySQL: by LOAD DATA LOCAL INFILE from a
+# TSV file) and merged into xlog, skipping sha1s already there,
+# by one insert ... select on the server.  A MySQL sink only
+# allows LOAD DATA LOCAL if made with bulk.
+# makeSink picks one from a db cfg dict:
+#   {'driver': 'SQLITE', 'database': 'xlog.s3'}
+#   {'driver': 'MYSQLDIRECT', 'host': ..., 'user': ..., 'password': ..., 'database': 'XLOG'}
+# Parallel writers (xlog2db WRITERS) each checkpoint a file in
+# their own progress row, filename '#' writer (partname), and a
+# file resumes from the least of them.
+# reconnect() reopens a sink's connection.  isdown(E) says if an
+# exception is the connection's (so worth spooling and retrying),
+# rather than the data's.
+# SinkPool shares up to n sinks (connections) among threads:
+# get() checks one out (made on first need), put() returns it.
+
+import os
+import tempfile
+import sqlite3
+import threading
+import queue
+
+# !!! Loadrecs match these xlog (and heartbeat) fields, in order.
+FNS_XLOG = ('rxts', 'txts', 'srcid', 'subid', 'el', 'sl', 'sha1', 'kvs')
+FNS_PROGRESS = ('srcid', 'subid', 'wpath', 'filename', 'processed')
+
+def partname(filename, n):
+    """Writer n's progress row name for filename."""
+    return '%s#%d' % (filename, n)
+
+def _S(x):
+    if isinstance(x, (bytes, bytearray)):
+        return x.decode()
+    return x
+
+_TSVESC = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\0': '\\0'})
+
+def _tsv(x):
+    """A LOAD DATA field (default escaping)."""
+    if x is None:
+        return '\\N'
+    return str(x).translate(_TSVESC)
+
+class Sink():
+
+    P = '%s'                    # Parameter marker.
+    MAXPARAMS = 10000           # Per sha1 in (...) query.
+
+    def __init__(self):
+        self.db = None
+        self.staging = False    # xlog_stage made (it's per connection).
+        self.rxtsindexed = True # xlog has an index on rxts (so sha1ssince is cheap).
+        P = self.P
+        self.fnl_xlog = ', '.join(FNS_XLOG)                         # Field name list.
+        self.fil_xlog = ', '.join([P] * len(FNS_XLOG))              # Insertion list.
+        self.ful_xlog = ', '.join(['%s=%s' % (fn, P) for fn in FNS_XLOG])  # Update list.
+        self.sql_insxlog = 'insert into xlog (%s) values (%s)' % (self.fnl_xlog, self.fil_xlog)
+        self.sql_inshbs = 'insert into heartbeat (%s) values (%s)' % (self.fnl_xlog, self.fil_xlog)
+        self.sql_updhbs = 'update heartbeat set %s where srcid=%s and subid=%s' % (self.ful_xlog, P, P)
+        self.sql_pkprogress = 'srcid=%s and subid=%s and wpath=%s and (filename=%s or filename like %s)' % (P, P, P, P, P)  # And parts.
+
+    def commit(self):
+        self.db.commit()
+
+    def rollback(self):
+        self.db.rollback()
+
+    def close(self):
+        try:  self.db.close()
+        except:  pass
+        self.db = None
+
+    def connect(self):
+        raise NotImplementedError
+
+    def reconnect(self):
+        self.close()
+        self.staging = False
+        self.connect()
+
+    def isdown(self, E):
+        return isinstance(E, (OSError, EOFError))
+
+    def dupes(self, sha1s):
+        """Return the set of (lowercase hex) sha1s already in xlog."""
+        z = set()
+        sha1s = list(sha1s)
+        try:
+            csr = self.db.cursor()
+            for x in range(0, len(sha1s), self.MAXPARAMS):
+                ask = sha1s[x:x + self.MAXPARAMS]
+                sql = 'select sha1 from xlog where sha1 in (%s)' % ', '.join([self.P] * len(ask))
+                csr.execute(sql, ask)
+                z.update(_S(r[0]).lower() for r in csr.fetchall())
+            return z
+        finally:
+            csr.close()
+
+    def insertxlog(self, loadrecs):
+        """Insert loadrecs into xlog."""
+        try:
+            csr = self.db.cursor()
+            csr.executemany(self.sql_insxlog, loadrecs)
+        finally:
+            csr.close()
+
+    def makestage(self, csr):
+        csr.execute('create temp table if not exists xlog_stage (seq integer primary key, %s)' % self.fnl_xlog)
+
+    def stage(self, csr, loadrecs):
+        """Into xlog_stage, in order."""
+        csr.executemany('insert into xlog_stage (%s) values (%s)' % (self.fnl_xlog, self.fil_xlog), loadrecs)
+
+    def bulkload(self, loadrecs):
+        """Insert those of loadrecs (unique by sha1) whose sha1s aren't already in xlog.  Returns the number inserted."""
+        try:
+            csr = self.db.cursor()
+            if not self.staging:
+                self.makestage(csr)
+                self.staging = True
+            self.stage(csr, loadrecs)
+            csr.execute('insert into xlog (%s) select %s from xlog_stage s left join xlog x on x.sha1 = s.sha1 '
+                        'where x.sha1 is null order by s.seq' % 
+                        (self.fnl_xlog, ', '.join(['s.' + fn for fn in FNS_XLOG])))
+            n = csr.rowcount
+            csr.execute('delete from xlog_stage')
+            return n
+        finally:
+            csr.close()
+
+    def gethbs(self):
+        """Return {(srcid, subid): txts} of the heartbeat table."""
+        try:
+            csr = self.db.cursor()
+            csr.execute('select srcid, subid, txts from heartbeat')
+            return {(_S(r[0]), _S(r[1])): float(r[2]) for r in csr.fetchall()}
+        finally:
+            csr.close()
+
+    def upserthbs(self, inserts, updates):
+        """Insert new (srcid, subid)s' heartbeats, and update others', guarded on txts.
+           Inserts whose keys are there after all (another collector's) are updates."""
+        try:
+            csr = self.db.cursor()
+            if inserts:
+                z = self.hbkeys(csr, [(v[2], v[3]) for v in inserts])              # !MAGIC! tuple indices.
+                if z:
+                    updates = list(updates) + [v for v in inserts if (v[2], v[3]) in z]
+                    inserts = [v for v in inserts if (v[2], v[3]) not in z]
+            if inserts:
+                csr.executemany(self.sql_inshbs, [list(v) for v in inserts])
+            if updates:
+                self.updatehbs(csr, updates)
+        finally:
+            csr.close()
+
+    def hbkeys(self, csr, keys):
+        """Return the set of keys, (srcid, subid)s, in the heartbeat table."""
+        z = set()
+        n = self.MAXPARAMS // 2
+        for x in range(0, len(keys), n):
+            ask = keys[x:x + n]
+            csr.execute('select srcid, subid from heartbeat where (srcid, subid) in (%s)' % 
+                        ', '.join(['(%s, %s)' % (self.P, self.P)] * len(ask)), [k for kk in ask for k in kk])
+            z.update((_S(r[0]), _S(r[1])) for r in csr.fetchall())
+        return z
+
+    def updatehbs(self, csr, updates):
+        """Update heartbeats, newer by txts only."""
+        csr.executemany(self.sql_updhbs + ' and txts < %s' % self.P, 
+                        [list(v) + [v[2], v[3], v[1]] for v in updates])     # !MAGIC! tuple indices.
+
+    def sha1ssince(self, since):
+        """Yield the sha1s of xlog rows received at or after since, oldest first."""
+        try:
+            csr = self.db.cursor()
+            csr.execute('select sha1 from xlog where rxts >= %s order by rxts' % self.P, (since, ))
+            for r in csr:
+                yield _S(r[0]).lower()
+        finally:
+            csr.close()
+
+    def getprogress(self, srcid, subid, wpath, filename, parts=0):
+        """Return filename's committed checkpoint, or 0.  parts > 1: the least of its
+           parts' checkpoints, if all are there (else filename's own)."""
+        try:
+            csr = self.db.cursor()
+            csr.execute('select filename, processed from progress where ' + self.sql_pkprogress, 
+                        (srcid, subid, wpath, filename, filename + '#%'))
+            z = {_S(r[0]): int(r[1]) for r in csr.fetchall()}
+            if parts > 1:
+                ps = [z.get(partname(filename, n)) for n in range(parts)]
+                if None not in ps:
+                    return min(ps)
+            return z.get(filename, 0)
+        finally:
+            csr.close()
+
+    def putprogress(self, srcid, subid, wpath, filename, processed):
+        raise NotImplementedError
+
+    def delprogress(self, srcid, subid, wpath, filename):
+        """Delete filename's checkpoint, and its parts'."""
+        try:
+            csr = self.db.cursor()
+            csr.execute('delete from progress where ' + self.sql_pkprogress, 
+                        (srcid, subid, wpath, filename, filename + '#%'))
+        finally:
+            csr.close()
+
+class MySQLSink(Sink):
+
+    CT_PROGRESS = """
+        create table if not exists progress (
+            srcid       varchar(16)  not null,
+            subid       varchar(16)  not null,
+            wpath       varchar(160) not null,
+            filename    varchar(32)  not null,
+            processed   bigint       not null,
+            primary key (srcid, subid, wpath, filename))
+    """
+
+    def __init__(self, host, user, password, database, bulk=False):
+        Sink.__init__(self)
+        self.cfg = (host, user, password, database)
+        self.bulk = bulk                # LOAD DATA LOCAL allowed (for bulkload).
+        self.connect()
+
+    def connect(self):
+        import mysql.connector as mc
+        from mysql.connector.constants import ClientFlag
+        host, user, password, database = self.cfg
+        # (Connectors newer than the pinned 2.0.4 also need 
+        # allow_local_infile=True, besides LOCAL_FILES, for bulk.)
+        self.db = mc.connect(host=host, user=user, password=password, db=database, raise_on_warnings=True, 
+                             client_flags=[ClientFlag.LOCAL_FILES] if self.bulk else [])
+        try:
+            csr = self.db.cursor()
+            csr.execute("show tables like 'progress'")
+            if not csr.fetchall():
+                csr.execute(self.CT_PROGRESS)
+            # xlog is shared, and not ours to index: just check.
+            csr.execute("show index from xlog where column_name = 'rxts' and seq_in_index = 1")
+            self.rxtsindexed = bool(csr.fetchall())
+        finally:
+            csr.close()
+            self.db.commit()
+
+    def isdown(self, E):
+        import mysql.connector as mc
+        return (isinstance(E, (mc.errors.OperationalError, mc.errors.InterfaceError)) or 
+                Sink.isdown(self, E))
+
+    # insertxlog: mysql.connector's executemany sends an insert's
+    # rows as one multi-row statement, which has to fit the server's 
+    # max_allowed_packet (1 to 64 MB, by version and install), else 
+    # it's "server has gone away".  So it's a statement per 
+    # MAXSTATEMENT bytes (estimated: kvs may be escaped to double).
+
+    MAXSTATEMENT = 2**20
+
+    def insertxlog(self, loadrecs):
+        """Insert loadrecs into xlog."""
+        try:
+            csr = self.db.cursor()
+            x = z = 0
+            for y, lr in enumerate(loadrecs):
+                n = 128 + 2 * len(lr[7])        # !MAGIC! kvs index.
+                if z and z + n > self.MAXSTATEMENT:
+                    csr.executemany(self.sql_insxlog, loadrecs[x:y])
+                    x = y
+                    z = 0
+                z += n
+            if x < len(loadrecs):
+                csr.executemany(self.sql_insxlog, loadrecs[x:])
+        finally:
+            csr.close()
+
+    # updatehbs: executemany of an update is a round trip per row,
+    # so it's one update, joined to the new heartbeats as a derived
+    # table, per MAXPARAMS parameters.  (The heartbeat table has no
+    # unique key for an insert ... on duplicate key update.)
+
+    def updatehbs(self, csr, updates):
+        """Update heartbeats, newer by txts only."""
+        sel = 'select ' + ', '.join(['%s as %s' % (self.P, fn) for fn in FNS_XLOG])
+        n = self.MAXPARAMS // len(FNS_XLOG)
+        for x in range(0, len(updates), n):
+            z = updates[x:x + n]
+            csr.execute('update heartbeat h join (%s) n on h.srcid = n.srcid and h.subid = n.subid set %s '
+                        'where n.txts > h.txts' % 
+                        (' union all '.join([sel] * len(z)), ', '.join(['h.%s = n.%s' % (fn, fn) for fn in FNS_XLOG])),
+                        [f for v in z for f in v])
+
+    def makestage(self, csr):
+        csr.execute("""
+            create temporary table if not exists xlog_stage (
+                seq     int unsigned not null auto_increment primary key,
+                rxts    double,
+                txts    double,
+                srcid   varchar(16),
+                subid   varchar(16),
+                el      varchar(4),
+                sl      varchar(4),
+                sha1    char(40),
+                kvs     mediumtext,
+                index (sha1))
+        """)
+
+    def stage(self, csr, loadrecs):
+        """Into xlog_stage, by LOAD DATA from a TSV file."""
+        fd, pfn = tempfile.mkstemp(prefix='xlog2db-', suffix='.tsv')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', newline='\n') as f:
+                for lr in loadrecs:
+                    f.write('\t'.join([_tsv(z) for z in lr]) + '\n')
+            csr.execute("load data local infile %s into table xlog_stage character set utf8mb4 "
+                        "fields terminated by '\\t' escaped by '\\\\' lines terminated by '\\n' (%s)" % ('%s', self.fnl_xlog),
+                        (pfn, ))
+        finally:
+            os.remove(pfn)
+
+    def putprogress(self, srcid, subid, wpath, filename, processed):
+        try:
+            csr = self.db.cursor()
+            csr.execute('insert into progress (%s) values (%%s, %%s, %%s, %%s, %%s) '
+                        'on duplicate key update processed=%%s' % ', '.join(FNS_PROGRESS),
+                        (srcid, subid, wpath, filename, processed, processed))      # (Not values(): deprecated.)
+        finally:
+            csr.close()
+
+class SQLiteSink(Sink):
+
+    P = '?'
+    MAXPARAMS = 900             # Under older sqlite's 999 variable limit.
+
+    def __init__(self, pfn):
+        Sink.__init__(self)
+        self.pfn = pfn
+        self.connect()
+
+    def connect(self):
+        # Made in one thread, used in another (one at a time: see SinkPool).
+        self.db = sqlite3.connect(self.pfn, check_same_thread=False)
+        self.db.execute('pragma journal_mode=wal')
+        self.db.execute('pragma synchronous=normal')
+        for t in ('xlog', 'heartbeat'):
+            self.db.execute("""
+                create table if not exists %s (
+                    id      integer primary key,
+                    rxts    real,
+                    txts    real,
+                    srcid   text,
+                    subid   text,
+                    el      text,
+                    sl      text,
+                    sha1    text,
+                    kvs     text)
+            """ % t)
+        self.db.execute('create index if not exists xlog_sha1 on xlog (sha1)')
+        self.db.execute('create index if not exists xlog_rxts on xlog (rxts)')
+        self.db.execute('create unique index if not exists heartbeat_srcid_subid on heartbeat (srcid, subid)')
+        self.db.execute("""
+            create table if not exists progress (
+                srcid       text    not null,
+                subid       text    not null,
+                wpath       text    not null,
+                filename    text    not null,
+                processed   integer not null,
+                primary key (srcid, subid, wpath, filename))
+        """)
+        self.db.commit()
+
+    # isdown: of OperationalErrors, only locked, busy, disk I/O, full
+    # and can't open are the file's (not "no such table", ...).  By
+    # sqlite_errorcode (python 3.11+), else by message.
+    DOWNCODES = (5, 6, 10, 13, 14)      # SQLITE_BUSY, _LOCKED, _IOERR, _FULL, _CANTOPEN.
+    DOWNMSGS = ('locked', 'busy', 'disk i/o', 'is full', 'unable to open')
+
+    def isdown(self, E):
+        if isinstance(E, sqlite3.OperationalError):
+            z = getattr(E, 'sqlite_errorcode', None)
+            if z is not None:
+                return (z & 0xff) in self.DOWNCODES
+            z = str(E).lower()
+            return any(m in z for m in self.DOWNMSGS)
+        return Sink.isdown(self, E)
+
+    # insertxlog: executemany reuses one prepared statement, and
+    # nothing is synced until commit.
+
+    def upserthbs(self, inserts, updates):
+        """One upsert statement, newer by txts only."""
+        try:
+            csr = self.db.cursor()
+            csr.executemany(self.sql_inshbs + ' on conflict (srcid, subid) do update set %s '
+                            'where excluded.txts > heartbeat.txts' %
+                            ', '.join(['%s=excluded.%s' % (fn, fn) for fn in FNS_XLOG]),
+                            [list(v) for v in (list(inserts) + list(updates))])
+        finally:
+            csr.close()
+
+    def putprogress(self, srcid, subid, wpath, filename, processed):
+        try:
+            csr = self.db.cursor()
+            csr.execute('insert into progress (%s) values (?, ?, ?, ?, ?) '
+                        'on conflict (srcid, subid, wpath, filename) do update set processed=excluded.processed' %
+                        ', '.join(FNS_PROGRESS),
+                        (srcid, subid, wpath, filename, processed))
+        finally:
+            csr.close()
+
+def makeSink(dbcfg, bulk=False):
+    """Return a connected Sink for a db cfg dict.  bulk: bulkload may be used."""
+    driver = (dbcfg.get('driver') or 'MYSQLDIRECT').upper()
+    if driver == 'SQLITE':
+        return SQLiteSink(dbcfg['database'])
+    elif driver.startswith('MYSQL'):
+        return MySQLSink(dbcfg['host'], dbcfg['user'], dbcfg['password'], dbcfg['database'], bulk)
+    else:
+        raise ValueError('unknown sink driver: %s' % repr(driver))
+
+class SinkPool():
+
+    def __init__(self, dbcfg, n=1, bulk=False):
+        self.dbcfg = dbcfg
+        self.bulk = bulk
+        self.n = max(1, n)
+        self.made = 0
+        self.lock = threading.Lock()
+        self.idle = queue.LifoQueue()   # Most recently used first.
+
+    def get(self):
+        """Check out a sink, waiting for one if all n are out."""
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            make = self.made < self.n
+            if make:
+                self.made += 1
+        if make:
+            try:
+                return makeSink(self.dbcfg, self.bulk)
+            except:
+                with self.lock:
+                    self.made -= 1
+                raise
+        return self.idle.get()
+
+    def put(self, sink):
+        """Return a checked out sink.  A closed one (db None) is dropped."""
+        if sink is None:
+            return
+        if sink.db is None:
+            with self.lock:
+                self.made -= 1
+            return
+        self.idle.put(sink)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,84 @@
+
+# *** XLOG2DB version ***
+
+# Spool: a durable, append-only queue of xlog batches, for when
+# the sink is down (or too slow).  xlog2db keeps parsing, and
+# advancing its files' 'processed', while batches go here, and
+# drains them (sha1 dedup is set-wise) once the sink is back.
+# The spool is a directory of segment files, NNNNNNNNNNNNNNNN.spool,
+# appended to in order and rolled at segmentbytes.  Each batch is
+# one frame: length, crc32 and a pickle of (filename, offset,
+# loadrecs, heartbeats).  A torn last frame (a crash mid append) is
+# ignored.
+# A segment is deleted once all its batches are committed, so a
+# drain interrupted by a crash is redone (sha1 dedup covers it).
+
+import os
+import struct
+import pickle
+import zlib
+
+SUFFIX = '.spool'
+HDR = struct.Struct('<II')      # Payload length, crc32.
+
+class Spool():
+
+    def __init__(self, path, segmentbytes=64 * 2**20, sync=True):
+        self.path = path
+        self.segmentbytes = segmentbytes
+        self.sync = sync                # fsync each append.
+        self.f = None                   # Segment being appended to.
+        self.segments = sorted(fn for fn in os.listdir(path) if fn.endswith(SUFFIX)) if os.path.isdir(path) else []
+        self.nbytes = sum(os.path.getsize(os.path.join(path, fn)) for fn in self.segments)
+
+    def __len__(self):
+        """Segments."""
+        return len(self.segments)
+
+    def close(self):
+        if self.f:
+            self.f.close()
+            self.f = None
+
+    def append(self, filename, offset, loadrecs, heartbeats=()):
+        """Durably append a batch."""
+        z = pickle.dumps((filename, offset, [tuple(lr) for lr in loadrecs], [tuple(v) for v in heartbeats]), protocol=4)
+        if self.f is None or self.f.tell() >= self.segmentbytes:
+            self.close()
+            n = (int(self.segments[-1][:-len(SUFFIX)]) + 1) if self.segments else 0
+            fn = '%016d%s' % (n, SUFFIX)
+            os.makedirs(self.path, exist_ok=True)
+            self.f = open(os.path.join(self.path, fn), 'ab')
+            self.segments.append(fn)
+        self.f.write(HDR.pack(len(z), zlib.crc32(z)) + z)
+        self.f.flush()
+        if self.sync:
+            os.fsync(self.f.fileno())
+        self.nbytes += HDR.size + len(z)
+
+    def oldest(self):
+        """Return the oldest segment's batches [(filename, offset, loadrecs, heartbeats), ...] (closing it if it's
+           being appended to), or None."""
+        if not self.segments:
+            return None
+        if len(self.segments) == 1:
+            self.close()
+        batches = []
+        with open(os.path.join(self.path, self.segments[0]), 'rb') as f:
+            while True:
+                h = f.read(HDR.size)
+                if len(h) < HDR.size:
+                    break
+                n, crc = HDR.unpack(h)
+                z = f.read(n)
+                if len(z) < n or zlib.crc32(z) != crc:
+                    break                               # Torn.
+                z = pickle.loads(z)
+                batches.append(z if len(z) > 3 else z + ([], ))     # (Spooled without heartbeats.)
+        return batches
+
+    def drop(self):
+        """Delete the oldest segment (drained)."""
+        pfn = os.path.join(self.path, self.segments.pop(0))
+        self.nbytes -= os.path.getsize(pfn)
+        os.remove(pfn)